@@ -0,0 +1,33 @@
+import os
+import numpy as np
+import pytest
+
+# size of the large benchmarks, make it smaller for a quick check:
+#   INS_NAV_BENCH_N=1000 pytest benchmarks
+N = int(os.environ.get("INS_NAV_BENCH_N", 10**6))
+
+
+@pytest.fixture(scope="session")
+def imu():
+    """N samples of accel, gyro, mag and dt"""
+    rng = np.random.default_rng(42)
+    a = np.array([0,0,1.]) + 0.05*rng.standard_normal((N,3))
+    g = 0.2*rng.standard_normal((N,3))
+    m = np.array([20,-5,-40.]) + 0.5*rng.standard_normal((N,3))
+    dt = 0.002*np.ones(N)
+    return a, g, m, dt
+
+
+@pytest.fixture(scope="session")
+def llh():
+    """N points (lat, lon, alt) [deg, deg, m] around the globe"""
+    rng = np.random.default_rng(42)
+    lat = rng.uniform(-89, 89, N)
+    lon = rng.uniform(-180, 180, N)
+    alt = rng.uniform(-100, 10000, N)
+    return np.stack((lat, lon, alt), axis=1)
+
+
+def once(benchmark, func, *args):
+    """Large benchmarks take seconds, so only run them once"""
+    return benchmark.pedantic(func, args=args, rounds=1, iterations=1)
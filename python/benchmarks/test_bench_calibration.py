@@ -0,0 +1,88 @@
+from ins_nav.calibration import magcal, accelcal, MagCalibrator, ellipsoid_fit, static_segments
+from ins_nav.calibration import magcal_batch, accelcal_batch
+from conftest import once, N
+import numpy as np
+
+order = ["x-up", "x-down", "y-up", "y-down", "z-up", "z-down"]
+
+
+def mag_data(n):
+    rng = np.random.default_rng(1)
+    v = rng.standard_normal((n,3))
+    v /= np.linalg.norm(v, axis=1)[:,None]
+    return v*np.array([45,50,40.]) + np.array([10,-20,5.])
+
+def accel_data(n):
+    rng = np.random.default_rng(1)
+    ideal = np.repeat(np.vstack((np.eye(3), -np.eye(3)))[[0,3,1,4,2,5]], n//6, axis=0)
+    return 1.02*ideal + 0.01 + 0.005*rng.standard_normal(ideal.shape)
+
+def test_magcal(benchmark):
+    benchmark(magcal, mag_data(60))
+
+def test_magcal_large(benchmark):
+    once(benchmark, magcal, mag_data(N))
+
+def test_accelcal(benchmark):
+    benchmark(accelcal, accel_data(60), order)
+
+def test_accelcal_large(benchmark):
+    once(benchmark, accelcal, accel_data(N), order)
+
+def raw_accel(n):
+    # six unequal holds with moves between them, like a raw capture. The
+    # shortest hold is n/12 and has to be longer than static_segments()
+    # min_windows*window (500 samples) to be found, so n is at least 12000
+    n = max(n, 12000)
+    rng = np.random.default_rng(1)
+    up = np.vstack((np.eye(3), -np.eye(3)))[[0,3,1,4,2,5]]
+    holds = (n*np.array([1,3,2,2,1,3])/12).astype(int)
+    move = rng.standard_normal((6,200,3))
+    parts = [p for i in range(6) for p in (np.tile(up[i], (holds[i],1)), move[i])]
+    g = np.vstack(parts)
+    return 1.02*g + 0.01 + 0.005*rng.standard_normal(g.shape)
+
+def test_static_segments_large(benchmark):
+    once(benchmark, static_segments, raw_accel(N))
+
+def test_accelcal_raw_large(benchmark):
+    once(benchmark, accelcal, raw_accel(N))
+
+def test_ellipsoid_fit_large(benchmark):
+    once(benchmark, ellipsoid_fit, mag_data(N))
+
+def test_magcal_streaming(benchmark):
+    # 560Hz mag in 1 sec chunks
+    m = mag_data(N)
+
+    def run():
+        cal = MagCalibrator()
+        for i in range(0, N, 560):
+            cal.update(m[i:i+560])
+        return cal.solve()
+
+    once(benchmark, run)
+
+def test_mag_tracker(benchmark):
+    from ins_nav.calibration.calmag import MagTracker
+    m = mag_data(N)
+    A, b, _ = magcal(m[:1000])
+
+    def run():
+        trk = MagTracker(b.copy(), A.copy())
+        for x in m:
+            trk.update(x)
+        return trk.bias
+
+    once(benchmark, run)
+
+def test_magcal_batch(benchmark):
+    # a shift of boards, N samples spread over 300 of them
+    n = max(N//300, 10)
+    once(benchmark, magcal_batch, mag_data(300*n).reshape(300, n, 3))
+
+def test_accelcal_batch(benchmark):
+    # each board gets n samples of every pose, in order
+    n = max(N//1800, 10)
+    a = accel_data(1800*n).reshape(6, 300, n, 3).transpose(1, 0, 2, 3).reshape(300, -1, 3)
+    once(benchmark, accelcal_batch, a, order)
@@ -0,0 +1,43 @@
+from ins_nav import Madgwick, Mahony, AHRS
+from ins_nav.filters.compass import TiltCompensatedCompass
+from conftest import once
+
+
+def test_madgwick_update(benchmark, imu):
+    a, g, m, dt = imu
+    f = Madgwick(0.1, 0.01)
+    benchmark(f.update, a[0], g[0], m[0], dt[0])
+
+def test_madgwick_run(benchmark, imu):
+    f = Madgwick(0.1, 0.01)
+    once(benchmark, f.run, *imu)
+
+def test_ahrs_update(benchmark, imu):
+    a, g, m, dt = imu
+    f = AHRS(0.1, 0.01)
+    benchmark(f.updateAGM, a[0].tolist(), g[0].tolist(), m[0].tolist(), dt[0])
+
+def test_mahony_update(benchmark, imu):
+    a, g, m, dt = imu
+    f = Mahony(0.5, 0.1)
+    benchmark(f.update, a[0].tolist(), g[0].tolist(), dt[0], m[0].tolist())
+
+def test_mahony_run(benchmark, imu):
+    a, g, m, dt = imu
+    f = Mahony(0.5, 0.1)
+    once(benchmark, f.run, a, g, dt, m)
+
+def test_compass(benchmark, imu):
+    a, _, m, _ = imu
+    c = TiltCompensatedCompass()
+    benchmark(c.compensate, a[0], m[0])
+
+def test_compass_log(benchmark, imu):
+    a, _, m, _ = imu
+    c = TiltCompensatedCompass()
+
+    def loop():
+        for aa, mm in zip(a, m):
+            c.compensate(aa, mm)
+
+    once(benchmark, loop)
@@ -0,0 +1,119 @@
+from ins_nav import WGS84, NavigationFrame, WaypointIndex
+from ins_nav.wgs84 import deg2rad
+from conftest import once
+import numpy as np
+import pytest
+
+wgs = WGS84()
+frame = NavigationFrame((40,-90,100))
+
+
+def test_llh2ecef(benchmark):
+    benchmark(wgs.llh2ecef, 40, -90, 100)
+
+def test_llh2ecef_track(benchmark, llh):
+    once(benchmark, wgs.llh2ecef, llh)
+
+def test_ecef2llh(benchmark):
+    benchmark(wgs.ecef2llh, (4510731., 4510731., 0.))
+
+def test_ecef2llh_track(benchmark, llh):
+    ecef = wgs.llh2ecef(llh)
+    once(benchmark, wgs.ecef2llh, ecef)
+
+@pytest.fixture(scope="module")
+def grid():
+    """Global grid of points, every degree, from 500m below to 100km up"""
+    lat, lon, alt = np.meshgrid(
+        np.linspace(-90, 90, 181),
+        np.linspace(-180, 180, 361),
+        [-500, 0, 1e3, 1e4, 1e5], indexing="ij")
+    return np.stack((lat.ravel(), lon.ravel(), alt.ravel()), axis=1)
+
+@pytest.mark.parametrize("method", ["zhu", "bowring", "iterative"])
+def test_ecef2llh_method(benchmark, grid, method):
+    """
+    Max errors end up in extra_info, see them with --benchmark-json
+    """
+    ecef = wgs.llh2ecef(grid)
+    with np.errstate(invalid="ignore"):
+        ans = once(benchmark, wgs.ecef2llh, ecef, method)
+
+    err = np.abs(ans - grid)
+    err[:,1] = np.abs((ans[:,1] - grid[:,1] + 180) % 360 - 180)
+    err[np.abs(grid[:,0]) == 90, 1] = 0  # longitude is anything at the poles
+    lat, lon, alt = np.nanmax(err, axis=0)
+
+    if benchmark.stats:  # None with --benchmark-disable
+        benchmark.extra_info["points/sec"] = len(grid)/benchmark.stats.stats.mean
+    benchmark.extra_info["lat err [m]"] = lat*wgs.a*deg2rad
+    benchmark.extra_info["lon err [m]"] = lon*wgs.a*deg2rad
+    benchmark.extra_info["alt err [m]"] = alt
+    benchmark.extra_info["nan"] = int(np.count_nonzero(np.isnan(ans).any(axis=1)))
+
+def test_haversine(benchmark):
+    benchmark(wgs.haversine, (40,-90), (41,-91))
+
+def test_haversine_track(benchmark, llh):
+    once(benchmark, wgs.haversine, llh[:-1], llh[1:])
+
+def test_geodesic_inverse_track(benchmark, llh):
+    once(benchmark, wgs.geodesic_inverse, llh[:-1], llh[1:])
+
+def test_haversine_blocks(benchmark, llh):
+    # 2000 waypoints against 2000 fixes
+    pts = llh[:2000]
+
+    def loop():
+        for i, d in wgs.haversine_blocks(pts, pts):
+            d.argmin(axis=1)
+
+    once(benchmark, loop)
+
+@pytest.mark.parametrize("name", ["ecef2enu", "enu2ecef", "ecef2ned", "ned2ecef"])
+def test_frame(benchmark, name):
+    func = getattr(frame, name)
+    benchmark(func, np.array([100.,200.,-5.]))
+
+@pytest.mark.parametrize("name", ["ecef2enu", "enu2ecef", "ecef2ned", "ned2ecef"])
+def test_frame_cloud(benchmark, name, llh):
+    func = getattr(frame, name)
+    pts = 1000*llh
+    out = np.empty_like(pts)
+    once(benchmark, func, pts, out)
+
+@pytest.mark.parametrize("tol", [None, 1.0])
+def test_llh2ned_local(benchmark, llh, tol):
+    # points within ~1km of the frame origin, tol=None is the exact path
+    pts = np.column_stack((40 + 1e-4*llh[:,0], -90 + 5e-5*llh[:,1], llh[:,2]/100))
+    out = np.empty_like(pts)
+    once(benchmark, frame.llh2ned, pts, tol, out)
+
+@pytest.mark.parametrize("method", ["index", "scan"])
+def test_waypoint_nearest(benchmark, llh, method):
+    # 100k waypoints, 1000 fixes, against a vectorized linear scan
+    wp = llh[:100000]
+    idx = WaypointIndex(wp)
+    idx.nearest(wp[0])  # builds the tree
+    fixes = llh[-1000:]
+
+    def loop():
+        for f in fixes:
+            if method == "index":
+                idx.nearest(f, 3)
+            else:
+                np.argpartition(wgs.haversine(f, wp), 3)[:3]
+
+    once(benchmark, loop)
+
+table = wgs.gravity_table()
+
+@pytest.mark.parametrize("name", ["gravity", "normal_gravity", "table"])
+def test_gravity(benchmark, name):
+    func = table if name == "table" else getattr(wgs, name)
+    benchmark(func, 45.3)
+
+@pytest.mark.parametrize("name", ["normal_gravity", "table"])
+def test_gravity_track(benchmark, name, llh):
+    func = table if name == "table" else wgs.normal_gravity
+    once(benchmark, func, llh[:,0], llh[:,2])
@@ -29,6 +29,8 @@ from adafruit_lsm6ds import LSM6DS33,AccelRange,GyroRange
 import adafruit_lps2x
 import adafruit_lis3mdl
 from math import pi
+import asyncio
+from ins_nav.acquire import Acquisition
 
 
 rad2deg = 180/pi
@@ -48,59 +50,49 @@ lps = adafruit_lps2x.LPS22(i2c)
 lis = adafruit_lis3mdl.LIS3MDL(i2c) # 155 Hz, 4 gauss, continuous
 lis.data_rate = adafruit_lis3mdl.Rate.RATE_560_HZ
 
-start = time.monotonic()
-last = start
+# each sensor is read at its own rate, so the slow barometer doesn't
+# hold back the 560Hz magnetometer
+acq = Acquisition()
+acq.add("imu", lambda: (imu.acceleration, imu.gyro), 208)
+acq.add("mag", lambda: lis.magnetic, 560)
+acq.add("baro", lambda: (lps.pressure, lps.temperature), 10)
+
+last = time.monotonic()
 cnt = 0
-m, p, t = 0, 0, 0
+a, g, m, p, t = (0,0,0), (0,0,0), (0,0,0), 0, 0
+
+def handler(name, ts, value):
+    global last, cnt, a, g, m, p, t
+
+    if name == "imu":
+        a, g = value
+        g = (g[0]*rad2deg, g[1]*rad2deg, g[2]*rad2deg,)
+    elif name == "mag":
+        m = value
+        cnt += 1
+    elif name == "baro":
+        p, t = value
+        p = 145366.45 * (1 - (p/1013.25)**0.190284) * 0.3048
+
+    if cnt == hz:
+        dt = ts - last
+        mhz = int(cnt/dt)
+
+        print(" "*80, end = "\r")
+        print('{}Hz | {:>5.2f} {:>5.2f} {:>5.2f}g | {:>5.1f} {:>5.1f} {:>5.1f}uT | {:>4.1f} {:>4.1f} {:>4.1f}dps | {:>6.2f}m | {:>4.1f}C'.format(
+            mhz,
+            a[0], a[1], a[2],
+            m[0], m[1], m[2],
+            g[0], g[1], g[2],
+            p,t),
+            # end = "\r"
+        )
+
+        last = ts
+        cnt = 0
 
 try:
-    while True:
-        # ts = time.time()
-        # ts = time.monotonic()
-        # dt = ts - last
-        # mhz = int(1/dt)
-        # last = ts
-
-        m = [0,0,0]
-        g = [0,0,0]
-        a = [0,0,0]
-
-        # a = imu.acceleration
-        # g = imu.gyro; g = (g[0]*rad2deg, g[1]*rad2deg, g[2]*rad2deg,)
-        m = lis.magnetic
-
-        # if cnt%10 == 0:
-        #     p = lps.pressure
-        #     p = 145366.45 * (1 - (p/1013.25)**0.190284) * 0.3048
-        #     # m = lis.magnetic
-        #     t = lps.temperature
-        #     # print(">")
-
-        if cnt % (hz) == 0:
-            # t = lps.temperature
-
-            ts = time.monotonic()
-            dt = ts - last
-            mhz = int(cnt/dt)
-
-            print(" "*80, end = "\r")
-            print('{}Hz | {:>5.2f} {:>5.2f} {:>5.2f}g | {:>5.1f} {:>5.1f} {:>5.1f}uT | {:>4.1f} {:>4.1f} {:>4.1f}dps | {:>6.2f}m | {:>4.1f}C'.format(
-                mhz,
-                a[0], a[1], a[2],
-                m[0], m[1], m[2],
-                g[0], g[1], g[2],
-                p,t),
-                # end = "\r"
-            )
-
-            last = ts
-
-        if cnt == hz:
-            cnt = 1
-        else:
-            cnt += 1
-
-        # rate.sleep()
+    asyncio.run(acq.run(handler))
 
 except KeyboardInterrupt:
     print(">> bye ...")
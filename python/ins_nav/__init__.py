@@ -3,10 +3,14 @@
 # Copyright (c) 2016 Kevin Walchko
 # see LICENSE for full details
 ##############################################
-from .nav_frames import NavigationFrame
-from .wgs84 import WGS84
-from .filters.madgwick import Madgwick
+from .nav_frames import NavigationFrame, FrameCache
+from .wgs84 import WGS84, GravityTable
+from .waypoints import WaypointIndex
+from .offsets import ECEFOffsets
+from .filters.madgwick import Madgwick, MadgwickFleet
 from .filters.mahony import Mahony
+from .filters.ahrs import AHRS
+from .backend import set_backend, get_backend
 
 from importlib.metadata import version # type: ignore
 
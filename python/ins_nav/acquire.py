@@ -0,0 +1,126 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import asyncio
+import inspect
+import time
+
+
+class Acquisition:
+    """
+    Reads several sensors at their own rates without one slow sensor
+    stalling the others. Each sensor is polled by its own coroutine,
+    samples are timestamped when the read finishes and put into a queue
+    that the filter (handler) consumes.
+
+    acq = Acquisition()
+    acq.add("imu", lambda: (imu.acceleration, imu.gyro), 208)
+    acq.add("mag", lambda: lis.magnetic, 560)
+    acq.add("baro", lambda: lps.pressure, 10)
+    asyncio.run(acq.run(handler))  # handler(name, timestamp, value)
+
+    maxsize: queue size, 0 is unbounded
+    clock: timestamp source [sec]
+    """
+    def __init__(self, maxsize=0, clock=time.monotonic):
+        self.sensors = []
+        self.maxsize = maxsize
+        self.clock = clock
+        self.counts = {}
+        self._stop = None
+
+    def add(self, name, read, rate, blocking=True):
+        """
+        name: sensor name passed to the handler
+        read: function that returns a reading, can also be a coroutine function
+        rate: how often to read [Hz]
+        blocking: run read in a thread so it doesn't block the event loop,
+            this is what the Adafruit I2C drivers need
+        """
+        self.sensors.append((name, read, 1.0/rate, blocking))
+        self.counts[name] = 0
+
+    def stop(self):
+        """Stops run() after the current sample"""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def _poll(self, name, read, period, blocking, queue):
+        loop = asyncio.get_running_loop()
+        clock = self.clock
+        wakeup = clock()
+
+        while not self._stop.is_set():
+            if inspect.iscoroutinefunction(read):
+                value = await read()
+            elif blocking:
+                value = await loop.run_in_executor(None, read)
+            else:
+                value = read()
+            await queue.put((name, clock(), value))
+            self.counts[name] += 1
+
+            # keep to the schedule, but if the read took too long then
+            # skip the missed samples instead of bursting to catch up
+            wakeup += period
+            now = clock()
+            if wakeup < now:
+                wakeup = now
+            await asyncio.sleep(wakeup - now)
+
+    async def run(self, handler, duration=None):
+        """
+        Runs until stop() is called or duration [sec] has passed
+
+        handler: handler(name, timestamp, value), can also be a coroutine
+            function
+        returns: number of samples read from each sensor {name: count}
+        """
+        self._stop = asyncio.Event()
+        queue = asyncio.Queue(self.maxsize)
+        is_async = inspect.iscoroutinefunction(handler)
+
+        tasks = [
+            asyncio.create_task(self._poll(*s, queue))
+            for s in self.sensors
+        ]
+
+        async def consume():
+            while True:
+                sample = await queue.get()
+                if is_async:
+                    await handler(*sample)
+                else:
+                    handler(*sample)
+                queue.task_done()
+
+        consumer = asyncio.create_task(consume())
+        # nothing empties the queue once the handler fails, so pollers
+        # waiting on a full queue would never see _stop
+        consumer.add_done_callback(lambda _: [t.cancel() for t in tasks])
+        stopped = asyncio.create_task(self._stop.wait())
+
+        try:
+            # a sensor or handler error also ends the run
+            await asyncio.wait(
+                tasks + [consumer, stopped],
+                timeout=duration,
+                return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._stop.set()
+            await asyncio.gather(*tasks, stopped, return_exceptions=True)
+
+            # let the handler finish what was already read
+            drained = asyncio.create_task(queue.join())
+            await asyncio.wait([drained, consumer], return_when=asyncio.FIRST_COMPLETED)
+            drained.cancel()
+            consumer.cancel()
+            await asyncio.gather(drained, consumer, return_exceptions=True)
+
+        for t in tasks + [consumer]:
+            if not t.cancelled() and t.exception() is not None:
+                raise t.exception()
+
+        return dict(self.counts)
@@ -0,0 +1,82 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+from types import FunctionType
+import warnings
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ("python", "numba")
+
+_backend = "python"
+_kernels = set()  # functions the numba backend is allowed to compile
+_compiled = {}    # function -> compiled version
+
+
+def set_backend(name):
+    """
+    Selects how the filter and geodesy hot loops are run
+
+    name: "python" (default) or "numba"
+    returns: the backend in use, if numba is not installed then this
+        falls back to python
+    """
+    global _backend
+
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid backend {name}, use one of {BACKENDS}")
+
+    if name == "numba" and numba is None:
+        warnings.warn("numba is not installed, using python backend")
+        name = "python"
+
+    _backend = name
+    return _backend
+
+
+def get_backend():
+    return _backend
+
+
+def jitable(func):
+    """
+    Marks a plain python function as a kernel that the numba backend
+    can compile. Kernels can only call numpy/math functions or other
+    kernels.
+    """
+    _kernels.add(func)
+    return func
+
+
+def kernel(func):
+    """
+    Returns func for the current backend, either the function itself or
+    its compiled version
+    """
+    if _backend == "python":
+        return func
+    return _compile(func)
+
+
+def _compile(func):
+    f = _compiled.get(func)
+    if f is None:
+        # numba can only call other compiled functions, so swap any kernels
+        # this one uses for their compiled version
+        g = dict(func.__globals__)
+        for name in func.__code__.co_names:
+            dep = g.get(name)
+            if isinstance(dep, FunctionType) and dep in _kernels:
+                g[name] = _compile(dep)
+
+        f = FunctionType(
+            func.__code__, g, func.__name__,
+            func.__defaults__, func.__closure__)
+        f = numba.njit(f)
+        _compiled[func] = f
+    return f
@@ -0,0 +1,99 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed size history of samples kept in a preallocated numpy array.
+    Once full, new samples overwrite the oldest ones.
+
+    buf = RingBuffer(10000, 3)  # 10000 samples of (x,y,z)
+    buf.push((x,y,z))
+    buf.extend(samples)         # [n,3]
+    a, b = buf.latest(100)      # views, oldest to newest, b may be empty
+
+    capacity: max number of samples
+    shape: shape of one sample, () for scalars
+    """
+    def __init__(self, capacity, shape=(), dtype=float):
+        if isinstance(shape, int):
+            shape = (shape,)
+        self.capacity = capacity
+        self.buffer = np.zeros((capacity,) + tuple(shape), dtype=dtype)
+        self.head = 0  # where the next sample goes
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def full(self):
+        return self.size == self.capacity
+
+    def clear(self):
+        self.head = 0
+        self.size = 0
+
+    def push(self, x):
+        """Adds one sample"""
+        self.buffer[self.head] = x
+        self.head += 1
+        if self.head == self.capacity:
+            self.head = 0
+        if self.size < self.capacity:
+            self.size += 1
+
+    def extend(self, xs):
+        """Adds a batch of samples [n,...] with at most two copies"""
+        xs = np.asarray(xs)
+        n = len(xs)
+        cap = self.capacity
+
+        if n >= cap:
+            self.buffer[:] = xs[-cap:]
+            self.head = 0
+            self.size = cap
+            return
+
+        end = self.head + n
+        if end <= cap:
+            self.buffer[self.head:end] = xs
+        else:
+            k = cap - self.head
+            self.buffer[self.head:] = xs[:k]
+            self.buffer[:n-k] = xs[k:]
+        self.head = end % cap
+        self.size = min(self.size + n, cap)
+
+    def latest(self, n=None):
+        """
+        Returns the latest n samples (all if None) as one or two views of
+        the buffer, oldest to newest. No data is copied.
+        """
+        if n is None or n > self.size:
+            n = self.size
+        start = self.head - n
+        if start >= 0:
+            return (self.buffer[start:self.head],)
+        if self.head == 0:
+            return (self.buffer[start:],)
+        return (self.buffer[start:], self.buffer[:self.head])
+
+    def array(self, n=None):
+        """Returns a copy of the latest n samples as one array"""
+        views = self.latest(n)
+        if len(views) == 1:
+            return views[0].copy()
+        return np.concatenate(views)
+
+    @property
+    def data(self):
+        """
+        View of every sample held, but NOT in time order. Good for things
+        like scatter plots or statistics where order doesn't matter.
+        """
+        return self.buffer[:self.size]
@@ -1,3 +1,4 @@
-from .calaccel import accelcal
-from .calmag import magcal
-from .calmag import magplot, MagPlot
+from .calaccel import accelcal, static_segments
+from .calmag import magcal, MagCalibrator, ellipsoid_fit
+from .batch import magcal_batch, accelcal_batch
+from .magplot import magplot, MagPlot
@@ -0,0 +1,169 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+
+from .calaccel import static_segments, poses
+
+# Calibrating many boards at once: every board's least squares problem is
+# built as stacked normal equations with einsum and solved with one batched
+# np.linalg.solve, instead of a python loop of magcal()/accelcal() calls.
+
+
+def _stack(data, mask):
+    """
+    Returns data as [K,3,N] (axis first so reductions over samples are
+    contiguous) with invalid samples zeroed, and mask [K,N]. data can be
+    a list of [n,3] arrays of different lengths (padded here).
+    """
+    if isinstance(data, (list, tuple)) and mask is None:
+        data = [np.asarray(d, dtype=float).reshape(-1, 3) for d in data]
+        N = max((len(d) for d in data), default=0)
+        out = np.zeros((len(data), 3, N))
+        mask = np.zeros((len(data), N), dtype=bool)
+        for k, d in enumerate(data):
+            out[k,:,:len(d)] = d.T
+            mask[k,:len(d)] = True
+        return out, mask
+
+    data = np.asarray(data, dtype=float).transpose(0, 2, 1)
+    if mask is None:
+        return np.ascontiguousarray(data), np.ones((data.shape[0], data.shape[2]), dtype=bool)
+    mask = np.asarray(mask, dtype=bool)
+    return np.where(mask[:,None,:], data, 0.0), mask
+
+
+def _solve(XtX, XtY):
+    """
+    Batched solve of XtX [K,n,n] x = XtY [K,n,m]. Boards whose normal
+    equations are singular (too few or degenerate samples) get NaN instead
+    of failing every board.
+    """
+    bad = ~(np.linalg.cond(XtX) < 1e12)
+    if np.any(bad):
+        XtX = XtX.copy()
+        XtX[bad] = np.eye(XtX.shape[-1])
+    x = np.linalg.solve(XtX, XtY)
+    x[bad] = np.nan
+    return x
+
+
+def _mean(total, n):
+    """total/n per board, nan for boards without samples"""
+    return np.divide(total, n, out=np.full(len(n), np.nan), where=n > 0)
+
+
+def magcal_batch(Bp, mask=None, uT=None):
+    """
+    magcal() for K boards at once, the same answer as calling it on each
+    board's valid samples, without the python loop.
+
+    A, b, expmfs, rms = magcal_batch(data)          # [K,N,3]
+    A, b, expmfs, rms = magcal_batch(data, mask)    # ragged, mask [K,N]
+    A, b, expmfs, rms = magcal_batch([m0, m1, ...]) # list of [n,3]
+
+    Bp: [K,N,3] magnetometer samples, or a list of [n,3]
+    mask: [optional] [K,N] True for the samples to use
+    uT: expected field strength, None uses each board's expmfs
+    returns:
+        A: [K,3,3] soft-iron scaling
+        b: [K,3] hard-iron offsets
+        expmfs: [K] expected field strength
+        rms: [K] rms of |m - b| - expmfs, how far off a sphere the data is
+        Boards that can't be solved are NaN.
+    """
+    B, mask = _stack(Bp, mask)
+    n = mask.sum(axis=1)
+    Y = np.einsum("kin,kin->kn", B, B)  # zero for masked samples
+    s = B.sum(axis=2)
+
+    # normal equations of |m|^2 = [x,y,z,1] @ beta, as in MagCalibrator
+    XtX = np.empty((len(B),4,4))
+    XtX[:,:3,:3] = B @ B.transpose(0,2,1)
+    XtX[:,:3,3] = s
+    XtX[:,3,:3] = s
+    XtX[:,3,3] = n
+    XtY = np.empty((len(B),4,1))
+    XtY[:,:3] = B @ Y[...,None]
+    XtY[:,3,0] = Y.sum(axis=1)
+
+    beta = _solve(XtX, XtY)[...,0]
+    b = 0.5*beta[:,:3]
+    bb = np.einsum("ki,ki->k", b, b)
+    expmfs = np.sqrt(beta[:,3] + bb)
+
+    # initial= so boards without samples (or N = 0) get -inf - inf
+    if mask.all():
+        r = (B.max(axis=2, initial=-np.inf) - B.min(axis=2, initial=np.inf))/2
+    else:
+        m = mask[:,None,:]
+        r = (np.where(m, B, -np.inf).max(axis=2, initial=-np.inf)
+             - np.where(m, B, np.inf).min(axis=2, initial=np.inf))/2
+    r[~(r > 0)] = np.nan
+    scale = (expmfs if uT is None else np.full(len(B), float(uT)))[:,None]/r
+    A = scale[:,:,None]*np.eye(3)
+
+    # |m - b|^2 = |m|^2 - 2m.b + b.b
+    d2 = Y - 2*(b[:,None,:] @ B)[:,0] + bb[:,None]
+    err = np.sqrt(np.maximum(d2, 0)) - expmfs[:,None]
+    rms = np.sqrt(_mean(np.where(mask, err*err, 0).sum(axis=1), n))
+    return A, b, expmfs, rms
+
+
+def accelcal_batch(noisey, axisOrder=None, mask=None, **kw):
+    """
+    accelcal() for K boards at once, the same answer as calling it on
+    each board, without the python loop or the printing.
+
+    A, rms = accelcal_batch(raw)                  # [K,N,3] raw recordings
+    A, rms = accelcal_batch(data, order, mask)    # six equal blocks
+
+    noisey: [K,N,3] accelerations [g], or a list of [n,3]
+    axisOrder: the six poses in recorded order, each board's valid samples
+        (in order, the mask can have gaps) are six equal blocks. None finds the poses
+        in each recording with static_segments(), which kw is passed to
+    mask: [optional] [K,N] True for the samples to use
+    returns:
+        A: [K,4,3], accel = [noisey|1] @ A[k], see correct()
+        rms: [K] rms error of the corrected static samples [g]
+        Boards that can't be solved (missing poses) are NaN.
+    """
+    a, mask = _stack(noisey, mask)
+    K, N = mask.shape
+    g = np.vstack((np.eye(3), -np.eye(3)))
+    pose = np.full((K,N), -1)  # pose index of each sample, -1 unused
+
+    if axisOrder is None:
+        for k in range(K):
+            segments, names = static_segments(a[k][:,mask[k]].T, **kw)
+            if len(set(names)) < 6:
+                continue
+            idx = np.flatnonzero(mask[k])
+            for (i, j), p in zip(segments.tolist(), names):
+                pose[k, idx[i:j]] = poses.index(p)
+    else:
+        order = np.array([poses.index(p) for p in axisOrder])
+        # block by position among the valid samples, masks can have gaps
+        block = mask.sum(axis=1)//6
+        j = (np.cumsum(mask, axis=1) - 1)//np.maximum(block, 1)[:,None]
+        use = mask & (j < 6) & (block[:,None] > 0)
+        pose[use] = order[j[use]]
+
+    # X = [a|1] as [K,4,N] and ideal [K,N,3], unused samples zeroed
+    use = pose >= 0
+    X = np.empty((K,4,N))
+    X[:,:3] = a
+    X[:,3] = 1
+    X *= use[:,None,:]
+    ideal = g[pose]
+    ideal[~use] = 0
+
+    XtX = X @ X.transpose(0,2,1)
+    XtY = X @ ideal
+    A = _solve(XtX, XtY)
+
+    err = X.transpose(0,2,1) @ A - ideal
+    rms = np.sqrt(_mean(np.einsum("knj,knj->k", err, err), use.sum(axis=1)))
+    return A, rms
@@ -45,16 +45,81 @@ def least_squares_fit(A, B):
     print(f"Sum residual error: {np.sum(res)}")
     return X
 
-def accelcal(noisey, axisOrder):
+# orientation names in the order of their gravity axis: +x, +y, +z, -x, ...
+poses = ["x-up", "y-up", "z-up", "x-down", "y-down", "z-down"]
+
+def static_segments(accel, window=50, tol=None, min_windows=10):
+    """
+    Finds where the sensor was held still in a continuous recording, so
+    accelcal() can work on a raw capture. The recording is cut into
+    windows of window samples and a window is static if the variance of
+    its samples is below tol. Runs of static windows pointing at the same
+    gravity axis are the segments.
+
+    accel: [N,3] raw accelerations [g]
+    window: samples per window
+    tol: largest static variance (summed over x,y,z) [g^2], None is 4x
+        the lower quartile of all the windows, which is about the noise
+        if at least a quarter of the recording is static
+    min_windows: shorter runs (the sensor passing through) are dropped
+    returns: segments [n,2] (start, stop) sample indices, names [n] of
+        the pose of each segment, see get_ideal()
+    """
+    accel = np.asarray(accel, dtype=float)
+    n = len(accel)//window
+    w = accel[:n*window].reshape(n, window, 3)  # view, no copy
+
+    # variance by sums so no [N,3] temporary is made
+    mean = w.sum(axis=1)/window
+    var = np.einsum("nwi,nwi->n", w, w)/window - np.einsum("ni,ni->n", mean, mean)
+    if tol is None:
+        tol = 4*np.percentile(var, 25) if n else 0.0
+
+    # pose index of each window, -1 if moving
+    axis = np.abs(mean).argmax(axis=1)
+    pose = np.where(mean[np.arange(n), axis] > 0, axis, axis + 3)
+    pose[var > tol] = -1
+
+    edges = np.flatnonzero(np.diff(pose, prepend=-2, append=-2))
+    start, stop = edges[:-1], edges[1:]
+    keep = (pose[start] >= 0) & (stop - start >= min_windows)
+    start, stop = start[keep], stop[keep]
+
+    segments = np.column_stack((start, stop))*window
+    names = [poses[i] for i in pose[start].tolist()]
+    return segments, names
+
+def accelcal(noisey, axisOrder=None, **kw):
+    """
+    noisey: [N,3] accelerations [g]
+    axisOrder: the six poses in the order they were recorded, each an
+        equal length block of noisey. None finds the poses in a raw
+        recording instead, see static_segments() which kw is passed to
+    returns: A [4,3], accel = [noisey|1] @ A, see correct()
+    """
+    noisey = np.asarray(noisey, dtype=float)
+    if axisOrder is None:
+        segments, names = static_segments(noisey, **kw)
+        missing = set(poses) - set(names)
+        if missing:
+            raise ValueError(f"Poses not found in recording: {sorted(missing)}")
+
+        # only the static samples, each with the gravity of its pose
+        start, stop = segments.T
+        noisey = np.concatenate([noisey[i:j] for i, j in segments.tolist()])
+        g = np.vstack((np.eye(3), -np.eye(3)))
+        ideal = np.repeat(g[[poses.index(p) for p in names]], stop - start, axis=0)
+    else:
+        ideal = None
+        for axis in axisOrder:
+            i = get_ideal(axis, len(noisey)//6)
+            if ideal is None:
+                ideal = i
+            else:
+                ideal = np.concatenate((ideal, i), axis=0)
+
     sz = noisey.shape
     noisey = np.concatenate((noisey, np.ones((sz[0],1))), axis=1)
-    ideal = None
-    for axis in axisOrder:
-        i = get_ideal(axis, sz[0]//6)
-        if ideal is None:
-            ideal = i
-        else:
-            ideal = np.concatenate((ideal, i), axis=0)
 
     xx = least_squares_fit(noisey, ideal)
     print("--------------------------------")
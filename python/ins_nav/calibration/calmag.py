@@ -5,93 +5,73 @@
 ##############################################
 import numpy as np
 
-try:
-    import matplotlib.pyplot as plt
+from .magplot import magplot, MagPlot # keep old import path working
 
-    def magplot(data):
-        """
-        Plot magnetometer data
-        """
-        x = [v[0] for v in data]
-        rx = (max(x)-min(x))/2
-        cx = min(x)+rx
-
-        y = [v[1] for v in data]
-        ry = (max(y)-min(y))/2
-        cy = min(y)+ry
-
-        z = [v[2] for v in data]
-        rz = (max(z)-min(z))/2
-        cz = min(z)+rz
 
-        alpha = 0.5
-        u = np.linspace(0, 2 * np.pi, 100)
-
-        plt.plot(rx*np.cos(u)+cx, ry*np.sin(u)+cy,'-r',label='xy')
-        plt.plot(x,y,'.r',alpha=alpha)
-
-        plt.plot(rx*np.cos(u)+cx, rz*np.sin(u)+cz,'-g',label='xz')
-        plt.plot(x,z,'.g',alpha=alpha)
+class MagCalibrator:
+    """
+    Streaming version of magcal(). Samples are folded into the 4x4 normal
+    equations of the sphere fit and the per axis min/max as they arrive,
+    so memory doesn't grow with the number of samples.
 
-        plt.plot(rz*np.cos(u)+cz, ry*np.sin(u)+cy,'-b',label='zy')
-        plt.plot(z,y, '.b',alpha=alpha)
+    cal = MagCalibrator()
+    for chunk in stream:        # [n,3] or a single (x,y,z)
+        cal.update(chunk)
+    A, b, expmfs = cal.solve()  # any time, same as magcal()
 
-        plt.title(f"CM:({cx:.1f}, {cy:.1f}, {cz:.1f}) uT  R:({rx:.1f}, {ry:.1f}, {rz:.1f}) uT")
-        plt.xlabel('$\mu$T')
-        plt.ylabel('$\mu$T')
-        plt.grid(True);
-        plt.axis('equal')
-        plt.legend();
+    uT: expected field strength for longitude/altitude. If None
+        is given, then automatically calculated and used
+    """
+    def __init__(self, uT=None):
+        self.uT = uT
+        self.reset()
 
+    def reset(self):
+        self.n = 0
+        self.XtX = np.zeros((4,4))   # X = [x,y,z,1]
+        self.XtY = np.zeros(4)       # Y = x^2+y^2+z^2
+        self.min = np.full(3, np.inf)
+        self.max = np.full(3, -np.inf)
 
-    class MagPlot:
+    def update(self, Bp):
         """
-        Real-time plotting of magnetometer values useful during calibration
-        data collection.
+        Bp: [n,3] magnetometer samples or a single sample
         """
-        def __init__(self, BUFFER_SIZE=10000):
-            self.fig, self.ax = plt.subplots(1, 1)
-            self.ax.set_aspect(1)
-
-            self.mag_x = deque(maxlen=BUFFER_SIZE)
-            self.mag_y = deque(maxlen=BUFFER_SIZE)
-            self.mag_z = deque(maxlen=BUFFER_SIZE)
-
-        def push(self, x,y,z):
-            # save data for real-time plotting
-            self.mag_x.append(x)
-            self.mag_y.append(y)
-            self.mag_z.append(z)
-
-        def plot(self, title=None):
-            # Clear all axis
-            self.ax.cla()
-            x = self.mag_x
-            y = self.mag_y
-            z = self.mag_z
+        Bp = np.asarray(Bp, dtype=float).reshape(-1, 3)
+        if len(Bp) == 0:
+            return
 
-            # Display the sub-plots
-            self.ax.scatter(x, y, color='r', label="X-Y")
-            self.ax.scatter(y, z, color='g', label="Y-Z")
-            self.ax.scatter(z, x, color='b', label="Z-X")
-            self.ax.grid()
-            self.ax.legend()
+        s = Bp.sum(axis=0)
+        Y = np.einsum("ij,ij->i", Bp, Bp)
 
-            if title is None:
-                title = "MagPlot"
-            self.ax.set_title(title)
+        self.XtX[:3,:3] += Bp.T @ Bp
+        self.XtX[:3,3] += s
+        self.XtX[3,:3] += s
+        self.XtX[3,3] += len(Bp)
+        self.XtY[:3] += Bp.T @ Y
+        self.XtY[3] += Y.sum()
 
-            # Pause the plot for INTERVAL seconds
-            plt.pause(0.01)
+        np.minimum(self.min, Bp.min(axis=0), out=self.min)
+        np.maximum(self.max, Bp.max(axis=0), out=self.max)
+        self.n += len(Bp)
 
-except ImportError:
-    print("Please install matplotlib to use")
+    def solve(self):
+        """
+        returns:
+            A: soft-iron 3x3 matrix of scaling
+            b: hard-iron offsets
+            expmfs: expected field strength
+        """
+        beta = np.linalg.solve(self.XtX, self.XtY)
+        b = 0.5*beta[:3]
 
-    class MagPlot:
-        pass
+        # expected mag field strength
+        expmfs = np.sqrt(beta[3] + b.dot(b))
 
-    def magplot(data):
-        pass
+        uT = expmfs if self.uT is None else self.uT
+        r = (self.max - self.min)/2
+        A = np.diag(uT/r)
+        return A, b, expmfs
 
 
 def magcal(Bp, uT=None):
@@ -106,25 +86,270 @@ def magcal(Bp, uT=None):
         b: hard-iron offsets
         expmfs: expected field strength
     """
-    Y = np.array([v[0]**2+v[1]**2+v[2]**2 for v in Bp])
-    X = np.hstack((Bp,np.ones((Bp.shape[0],1))))
-    beta = np.linalg.inv(X.T.dot(X)).dot(X.T.dot(Y))
-    b=0.5*beta[:3]
+    cal = MagCalibrator(uT)
+    cal.update(Bp)
+    return cal.solve()
+
+
+def ellipsoid_fit(Bp, uT=None):
+    """
+    Full ellipsoid fit of magnetometer data, unlike magcal() the soft-iron
+    matrix isn't limited to a diagonal, so cross axis coupling is removed,
+    and it uses every point instead of just the axis extremes.
+
+    Fits x'Mx + 2x'n = 1 (9 parameters) by least squares, then the
+    eigendecomposition of M gives A = sqrt(M) so |A (m - b)| = uT.
+    The results go straight into Madgwick:
+
+        f.M, f.bias, _ = ellipsoid_fit(data)
+
+    inputs:
+        Bp: [N,3] data points, should cover as many orientations as
+            possible
+        uT: expected field strength for longitude/altitude. If None
+            is given, then automatically calculated and used
+    returns:
+        A: soft-iron 3x3 symmetric matrix, m = A @ (m - b)
+        b: hard-iron offsets
+        expmfs: expected field strength, radius of a sphere with the same
+            volume as the ellipsoid
+
+    ref: Li, Griffiths, Least squares ellipsoid specific fitting, 2004
+    """
+    Bp = np.asarray(Bp, dtype=float)
+
+    # centering the data keeps the normal equations well conditioned
+    c = Bp.mean(axis=0)
+    x, y, z = (Bp - c).T
+    D = np.stack((x*x, y*y, z*z, 2*x*y, 2*x*z, 2*y*z, 2*x, 2*y, 2*z), axis=1)
+    try:
+        v = np.linalg.solve(D.T @ D, D.sum(axis=0))
+    except np.linalg.LinAlgError:
+        v = np.zeros(9)  # all in a plane or line, reported below
+
+    M = np.array([
+        [v[0], v[3], v[4]],
+        [v[3], v[1], v[5]],
+        [v[4], v[5], v[2]]])
+    n = v[6:]
 
-    # expected mag field strength
-    expmfs=np.sqrt(beta[3]+b[0]**2+b[1]**2+b[2]**2)
+    # (x-o)'M(x-o) = 1 + o'Mo where o = -inv(M)n is the center
+    w, V = np.linalg.eigh(M)
+    if np.any(w <= 0):
+        raise ValueError("magnetometer data doesn't fit an ellipsoid, need more orientations")
 
+    o = -np.linalg.solve(M, n)
+    k = 1 + o.dot(M).dot(o)
+    w = w/k
+    if np.any(w <= 0):
+        raise ValueError("magnetometer data doesn't fit an ellipsoid, need more orientations")
+
+    expmfs = np.prod(w)**(-1/6)
     if uT is None:
         uT = expmfs
 
-    x = [v[0] for v in Bp]
-    rx = (max(x)-min(x))/2
+    A = uT*(V*np.sqrt(w)) @ V.T
+    b = o + c
+    return A, b, expmfs
+
+
+class MagTracker:
+    """
+    Tracks hard-iron (bias) and soft-iron (M) while running by recursive
+    least squares on the same ellipsoid as ellipsoid_fit(), with a
+    forgetting factor so a payload change is learned without stopping.
+    bias and M are updated in place, so they can be the filter's own
+    arrays, see Madgwick.track_mag().
+
+    trk = MagTracker(bias, M)    # start from an offline calibration
+    trk.update(m)                # every raw sample, False if gated out
+    m = M @ (m - bias)
+
+    bias: [3] float array updated in place, starting estimate
+    M: [3,3] float array updated in place, starting estimate
+    uT: field strength M scales to, None keeps the starting M's scale
+        (its determinant)
+    forget: RLS forgetting factor, 1 never forgets, 1 - 1/forget is
+        roughly how many samples are remembered
+    gate: samples whose error is more than gate sigmas are not used
+    noise: magnetometer noise, same units as the samples
+    soft_every: M is recomputed every this many samples (bias is every
+        sample), 0 only tracks bias
+    window: samples the running error level is averaged over, a few bad
+        samples are gated out but when the error stays high for about
+        this long the calibration has changed and is relearned
+    confidence: uncertainty of the starting estimate as a fraction of the
+        field, bigger learns faster but is noisier
+    """
+    def __init__(self, bias=None, M=None, uT=None, forget=0.9999, gate=4.0,
+                 noise=0.5, soft_every=50, window=500, confidence=0.02):
+        self.bias = np.zeros(3) if bias is None else bias
+        self.M = np.eye(3) if M is None else M
+        self.uT = uT
+        self.forget = forget
+        self.gate = gate
+        self.noise = noise
+        self.soft_every = soft_every
+        self.window = window
+        self.confidence = confidence
+
+        # preallocated so update() doesn't create arrays
+        self.phi = np.zeros(9)
+        self.Pphi = np.zeros(9)
+        self.K = np.zeros(9)
+        self.Ke = np.zeros(9)
+        self.tmp = np.zeros((9,9))
+        self.reset()
+
+    def reset(self):
+        """Restarts the estimate from the current bias and M"""
+        self.theta = None
+        self.P = np.zeros((9,9))
+        self.n = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.relearns = 0
+        self.relearning = False
+
+    def _start(self, m):
+        """
+        Starts the estimate from the current bias and M, the scale comes
+        from m. Returns False (not started) if m is too close to the bias
+        to give one, like a zeroed reading at power up.
+        """
+        d = m - self.bias
+        s = float(np.linalg.norm(d))
+        r = float(np.linalg.norm(self.M @ d))
+        if not (s > 10*self.noise and r > 0):
+            return False
+
+        # the fit is done in x = (m - c)/s so the numbers are all about 1
+        self.c = self.bias.copy()
+        self.c0, self.c1, self.c2 = self.c.tolist()
+        self.s = s
+        self.det = float(np.linalg.det(self.M))
+
+        # |M(m - b)| = r  =>  x'(s^2 M'M/r^2)x = 1
+        Q = (self.s/r)**2 * (self.M.T @ self.M)
+        self.theta = np.array([Q[0,0], Q[1,1], Q[2,2], Q[0,1], Q[0,2], Q[1,2], 0., 0., 0.])
+        # P is the covariance over R, the measurement noise of the fit
+        self.R = (2*self.noise/self.s)**2
+        self.P0 = self.confidence**2/self.R
+        self.v = self.R  # running error variance
+        self.P[:] = 0
+        self.P.flat[::10] = self.P0
+        return True
 
-    y = [v[1] for v in Bp]
-    ry = (max(y)-min(y))/2
+    def update(self, m):
+        """
+        m: one raw magnetometer sample (x,y,z)
+        returns: True if the sample was used, False if it was gated out
+            or is too close to the bias to start tracking from
+        """
+        if self.theta is None and not self._start(np.asarray(m, dtype=float)):
+            return False
+
+        s = self.s
+        x = (m[0] - self.c0)/s
+        y = (m[1] - self.c1)/s
+        z = (m[2] - self.c2)/s
+        phi = self.phi
+        phi[:] = (x*x, y*y, z*z, 2*x*y, 2*x*z, 2*y*z, 2*x, 2*y, 2*z)
+
+        P, Pphi, K, theta = self.P, self.Pphi, self.K, self.theta
+        np.dot(P, phi, out=Pphi)
+        pp = float(phi.dot(Pphi))
+        e = 1.0 - float(phi.dot(theta))
+
+        # Gate on the running error level. Errors going into it are
+        # clipped at the gate, so a spike barely moves it, but if the
+        # error stays high (calibration changed) it grows until the
+        # samples pass again.
+        self.n += 1
+        R = self.R
+        lim = self.gate**2 * max(self.v, R*(1 + pp))
+        e2 = e*e
+        self.v += (min(e2, lim) - self.v)/self.window
+
+        if not self.relearning and self.v > self.gate**2 * R:
+            # forget the old estimate's confidence to learn the new one
+            P[:] = 0
+            P.flat[::10] = self.P0
+            self.relearning = True
+            self.relearns += 1
+        elif self.relearning and self.v < self.gate * R:
+            self.relearning = False
+
+        if e2 > lim:
+            self.rejected += 1
+            return False
+        self.accepted += 1
 
-    z = [v[2] for v in Bp]
-    rz = (max(z)-min(z))/2
+        # theta += K e,  P = (P - K Pphi')/forget
+        np.multiply(Pphi, 1/(self.forget + pp), out=K)
+        np.multiply(K, e, out=self.Ke)
+        theta += self.Ke
+        np.outer(K, Pphi, out=self.tmp)
+        P -= self.tmp
 
-    A = np.diag([uT/rx,uT/ry,uT/rz])
-    return A,b,expmfs
+        # only forget while the uncertainty is below where it started,
+        # otherwise directions the data doesn't cover wind up
+        if P.trace() < 9*self.P0:
+            P *= 1/self.forget
+
+        self._bias()
+        if self.soft_every and self.accepted % self.soft_every == 0:
+            self._soft()
+        return True
+
+    def _shape(self):
+        a, b, c, d, e, f, g, h, i = self.theta
+        # center o = -inv(Q)n, inv by cofactors to stay in floats
+        A00 = b*c - f*f; A01 = e*f - d*c; A02 = d*f - b*e
+        A11 = a*c - e*e; A12 = d*e - a*f; A22 = a*b - d*d
+        det = a*A00 + d*A01 + e*A02
+        if det <= 0:
+            return None
+        o0 = -(A00*g + A01*h + A02*i)/det
+        o1 = -(A01*g + A11*h + A12*i)/det
+        o2 = -(A02*g + A12*h + A22*i)/det
+        return o0, o1, o2
+
+    def _bias(self):
+        o = self._shape()
+        if o is None:
+            return
+        s = self.s
+        self.bias[0] = self.c[0] + s*o[0]
+        self.bias[1] = self.c[1] + s*o[1]
+        self.bias[2] = self.c[2] + s*o[2]
+
+    def _soft(self):
+        o = self._shape()
+        if o is None:
+            return
+        a, b, c, d, e, f = self.theta[:6].tolist()
+        Q = np.array([[a, d, e], [d, b, f], [e, f, c]])
+        o = np.array(o)
+        Q /= 1 + o.dot(Q).dot(o)
+        w, V = np.linalg.eigh(Q)
+        if np.any(w <= 0):
+            return
+        w = np.sqrt(w)
+        if self.uT is None:
+            k = np.cbrt(self.det/np.prod(w))
+        else:
+            k = self.uT/self.s
+        self.M[:] = k*(V*w) @ V.T
+
+    def run(self, mag):
+        """
+        Tracks a whole log, returns the calibrated samples [N,3] using the
+        estimate at each sample
+        """
+        mag = np.asarray(mag, dtype=float)
+        out = np.empty(mag.shape)
+        for i, m in enumerate(mag):
+            self.update(m)
+            np.dot(self.M, m - self.bias, out=out[i])
+        return out
@@ -1,2 +1,4 @@
 from .mahony import Mahony
-from .madgwick import Madgwick
+from .madgwick import Madgwick, MadgwickFleet
+from .ahrs import AHRS
+from .sweep import sweep
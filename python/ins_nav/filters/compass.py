@@ -7,11 +7,47 @@
 from math import cos, sin, pi, atan2, asin, sqrt
 from squaternion import Quaternion
 from ins_nav.utils import rad2deg
-from ins_nav.utils import normalize3
+from ins_nav.backend import jitable, kernel
 from enum import IntFlag
 
 Angle = IntFlag("Angle", "degrees radians quaternion")
 
+
+@jitable
+def tilt_compensate(ax, ay, az, mx, my, mz):
+    """
+    Returns (roll, pitch, heading) in radians with heading between 0 and
+    2*pi. Raises ZeroDivisionError if accel or mag are all zeros.
+    """
+    # checked here because numpy floats give nan instead of raising
+    n = sqrt(mx*mx + my*my + mz*mz)
+    if n == 0.0:
+        raise ZeroDivisionError("mag is all zeros")
+    mx = mx/n; my = my/n; mz = mz/n
+    n = sqrt(ax*ax + ay*ay + az*az)
+    if n == 0.0:
+        raise ZeroDivisionError("accel is all zeros")
+    ax = ax/n; ay = ay/n; az = az/n
+
+    pitch = asin(-ax)
+
+    if abs(pitch) >= pi/2:
+        roll = 0.0
+    else:
+        roll = asin(ay/cos(pitch))
+
+    x = mx*cos(pitch)+mz*sin(pitch)
+    y = mx*sin(roll)*sin(pitch)+my*cos(roll)-mz*sin(roll)*cos(pitch)
+    heading = atan2(y, x)
+
+    # wrap heading between 0 and 360 degrees
+    if heading > 2*pi:
+        heading -= 2*pi
+    elif heading < 0:
+        heading += 2*pi
+
+    return roll, pitch, heading
+
 # @attr.s(slots=True)
 class TiltCompensatedCompass(object):
     """
@@ -36,30 +72,15 @@ class TiltCompensatedCompass(object):
 
     def compensate(self, accel, mag):
         """
+        accel: (x,y,z) acceleration, any units
+        mag: (x,y,z) magnetometer, any units
 
+        returns: (roll, pitch, heading) or a Quaternion
         """
 
         try:
-            mx, my, mz = normalize3(*mag)
-            ax, ay, az = normalize3(*accel)
-
-            pitch = asin(-ax)
-
-            if abs(pitch) >= pi/2:
-                roll = 0.0
-            else:
-                roll = asin(ay/cos(pitch))
-
-            # mx, my, mz = mag
-            x = mx*cos(pitch)+mz*sin(pitch)
-            y = mx*sin(roll)*sin(pitch)+my*cos(roll)-mz*sin(roll)*cos(pitch)
-            heading = atan2(y, x)
-
-            # wrap heading between 0 and 360 degrees
-            if heading > 2*pi:
-                heading -= 2*pi
-            elif heading < 0:
-                heading += 2*pi
+            roll, pitch, heading = kernel(tilt_compensate)(
+                accel[0], accel[1], accel[2], mag[0], mag[1], mag[2])
 
             if self.angle_units == Angle.degrees:
                 roll    *= rad2deg
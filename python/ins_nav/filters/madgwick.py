@@ -7,6 +7,88 @@ import numpy as np
 from numpy.linalg import norm
 from squaternion import Quaternion
 from math import sqrt
+from ins_nav.backend import jitable, kernel, get_backend
+
+
+@jitable
+def marg_step(q0,q1,q2,q3, e0,e1,e2,e3, ax,ay,az, gx,gy,gz, mx,my,mz, dt, B, zeta, wcomp=True):
+    """
+    Closed form of Madgwick.update() written with plain arithmetic so it
+    works on python floats (one filter) or numpy column arrays (many filters).
+    The magnetometer reading must already be calibrated: M @ (m - bias)
+
+    q0-q3: current orientation quaternion (w,x,y,z)
+    e0-e3: integrated gyro error quaternion (qwe), gyro bias is zeta*e1:e3
+    a: acceleration, normalized here so can be in any units
+    g: gyro rates [rads/sec]
+    m: magnetometer
+    dt: time step [sec]
+
+    returns: q0,q1,q2,q3,e0,e1,e2,e3
+    """
+    n = (ax*ax + ay*ay + az*az)**0.5
+    ax = ax/n; ay = ay/n; az = az/n
+
+    # Earth magnetic field reference, h = q*m*q.conjugate # 45, 46
+    hx = (q0*q0+q1*q1-q2*q2-q3*q3)*mx + 2*(q1*q2-q0*q3)*my + 2*(q1*q3+q0*q2)*mz
+    hy = 2*(q1*q2+q0*q3)*mx + (q0*q0-q1*q1+q2*q2-q3*q3)*my + 2*(q2*q3-q0*q1)*mz
+    bz = 2*(q1*q3-q0*q2)*mx + 2*(q2*q3+q0*q1)*my + (q0*q0-q1*q1-q2*q2+q3*q3)*mz
+    bx = (hx*hx + hy*hy)**0.5
+
+    f1 = 2*(q1*q3-q0*q2)-ax # 25
+    f2 = 2*(q0*q1+q2*q3)-ay
+    f3 = 2*(0.5-q1*q1-q2*q2)-az
+    f4 = 2*bx*(0.5-q2*q2-q3*q3)+2*bz*(q1*q3-q0*q2)-mx # 29
+    f5 = 2*bx*(q1*q2-q0*q3)+2*bz*(q0*q1+q2*q3)-my
+    f6 = 2*bx*(q0*q2+q1*q3)+2*bz*(0.5-q1*q1-q2*q2)-mz
+
+    # Jg.T @ fg + Jb.T @ fb # 26, 30
+    s0 = -2*q2*f1 + 2*q1*f2 - 2*bz*q2*f4 + (-2*bx*q3+2*bz*q1)*f5 + 2*bx*q2*f6
+    s1 = 2*q3*f1 + 2*q0*f2 - 4*q1*f3 + 2*bz*q3*f4 + (2*bx*q2+2*bz*q0)*f5 + (2*bx*q3-4*bz*q1)*f6
+    s2 = -2*q0*f1 + 2*q3*f2 - 4*q2*f3 + (-4*bx*q2-2*bz*q0)*f4 + (2*bx*q1+2*bz*q3)*f5 + (2*bx*q0-4*bz*q2)*f6
+    s3 = 2*q1*f1 + 2*q2*f2 + (-4*bx*q3+2*bz*q1)*f4 + (-2*bx*q0+2*bz*q2)*f5 + 2*bx*q1*f6
+
+    n = (s0*s0 + s1*s1 + s2*s2 + s3*s3)**0.5
+    n = n + (n == 0.0) # no correction when the gradient vanishes
+    s0 = s0/n; s1 = s1/n; s2 = s2/n; s3 = s3/n
+
+    if wcomp:
+        # qwe = q.conjugate*del_f, already unit length # 47
+        e0 = e0 + (q0*s0 + q1*s1 + q2*s2 + q3*s3)*dt
+        e1 = e1 + (q0*s1 - q1*s0 - q2*s3 + q3*s2)*dt
+        e2 = e2 + (q0*s2 + q1*s3 - q2*s0 - q3*s1)*dt
+        e3 = e3 + (q0*s3 - q1*s2 + q2*s1 - q3*s0)*dt
+        gx = gx - zeta*e1 # 48, 49
+        gy = gy - zeta*e2
+        gz = gz - zeta*e3
+
+    # qdot = 0.5*q*w - B*del_f, then integrate
+    q0, q1, q2, q3 = (
+        q0 + (0.5*(-q1*gx - q2*gy - q3*gz) - B*s0)*dt,
+        q1 + (0.5*( q0*gx + q2*gz - q3*gy) - B*s1)*dt,
+        q2 + (0.5*( q0*gy - q1*gz + q3*gx) - B*s2)*dt,
+        q3 + (0.5*( q0*gz + q1*gy - q2*gx) - B*s3)*dt)
+
+    n = (q0*q0 + q1*q1 + q2*q2 + q3*q3)**0.5
+    return q0/n, q1/n, q2/n, q3/n, e0, e1, e2, e3
+
+
+@jitable
+def marg_replay(q0,q1,q2,q3, e0,e1,e2,e3, accel, gyro, mag, dt, B, zeta, wcomp, out):
+    """
+    Runs marg_step() over a whole log, out[i] is (q0..q3,e0..e3) after
+    sample i. The inputs are either [N,3] arrays or lists of lists.
+    """
+    for i in range(len(dt)):
+        a = accel[i]
+        g = gyro[i]
+        m = mag[i]
+        q0,q1,q2,q3,e0,e1,e2,e3 = marg_step(
+            q0,q1,q2,q3, e0,e1,e2,e3,
+            a[0],a[1],a[2], g[0],g[1],g[2], m[0],m[1],m[2],
+            dt[i], B, zeta, wcomp)
+        out[i,0] = q0; out[i,1] = q1; out[i,2] = q2; out[i,3] = q3
+        out[i,4] = e0; out[i,5] = e1; out[i,6] = e2; out[i,7] = e3
 
 
 class Madgwick:
@@ -16,20 +98,40 @@ class Madgwick:
         and inertial/magnetic sensor arrays
     """
     def __init__(self, B, Z):
-        self.wb = np.array([0,0,0])
-        self.q = Quaternion()
         self.wcomp = True
         self.B = B
         self.zeta = Z
-        self.qwe = Quaternion(0,0,0,0)
         self.bias = np.array([0.,0.,0.])
         self.M = np.eye(3)
+        self.tracker = None
+        self.reset()
+
+    def reset(self):
+        """Resets the orientation and gyro bias estimate"""
+        self.q = Quaternion()
+        self.qwe = Quaternion(0.,0.,0.,0.)
+        self.wb = np.array([0.,0.,0.])
+
+    def track_mag(self, **kw):
+        """
+        Turns on online hard/soft-iron tracking, bias and M are then
+        updated in place from every magnetometer sample. Call again after
+        replacing bias or M, set tracker to None to turn it off.
+
+        kw: options for MagTracker
+        returns: the MagTracker
+        """
+        from ins_nav.calibration.calmag import MagTracker
+        self.bias = np.array(self.bias, dtype=float)
+        self.M = np.array(self.M, dtype=float)
+        self.tracker = MagTracker(self.bias, self.M, **kw)
+        return self.tracker
 
     def comp(self, del_f, dt):
         q = self.q
         qwe = 2.0*q.conjugate*del_f # 47
         self.qwe = self.qwe + qwe.normalize*dt
-        self.wb = self.wb + self.zeta*np.array(self.qwe[1:]) # 48
+        self.wb = self.zeta*np.array(self.qwe[1:]) # 48
         return self.wb
 
     def calc_b(self,m):
@@ -69,11 +171,12 @@ class Madgwick:
         aa = np.vstack((Jg,Jb))  # [6x4]
         bb = np.vstack((fg,fb))  # [6x1]
         cc = (aa.T @ bb).ravel() # [4x6]*[6x1] = [4x1]
-        self.q = Quaternion(*cc).normalize
-        return self.q
+        return Quaternion(*cc).normalize
 
     def update(self,a,g,m,dt):
         a = a/norm(a)
+        if self.tracker is not None:
+            self.tracker.update(m)
         m = self.M @ (m - self.bias)
         w = g
         q = self.q
@@ -89,3 +192,99 @@ class Madgwick:
         q = q + qdot*dt    # integrate
         self.q = q.normalize
         return self.q
+
+    def run(self, accel, gyro, mag, dt):
+        """
+        Replays a whole sensor log through the filter, starting from the
+        current state. The filter state is left at the last sample, so
+        calling update() afterwards continues where the log ended.
+
+        accel: [N,3] accelerations, any units
+        gyro: [N,3] gyro rates [rads/sec]
+        mag: [N,3] raw magnetometer, M and bias are applied here, and
+            tracked sample by sample if track_mag() is on
+        dt: time step [sec], either a scalar or [N]
+
+        returns: q [N,4] quaternions (w,x,y,z), wb [N,3] gyro bias estimates
+        """
+        accel = np.asarray(accel, dtype=float)
+        gyro = np.asarray(gyro, dtype=float)
+        if self.tracker is not None:
+            mag = self.tracker.run(mag)
+        else:
+            mag = (np.asarray(mag, dtype=float) - self.bias) @ self.M.T
+        N = accel.shape[0]
+        dt = np.broadcast_to(np.asarray(dt, dtype=float), (N,))
+
+        out = np.empty((N,8))
+
+        if get_backend() == "python":
+            # python floats are much faster than numpy scalars in this loop
+            accel, gyro, mag, dt = accel.tolist(), gyro.tolist(), mag.tolist(), dt.tolist()
+        else:
+            dt = np.ascontiguousarray(dt)
+
+        kernel(marg_replay)(
+            *self.q, *self.qwe, accel, gyro, mag, dt,
+            self.B, self.zeta, self.wcomp, out)
+
+        wb = self.zeta*out[:,5:]
+        if N > 0:
+            self.q = Quaternion(*out[-1,:4].tolist())
+            self.qwe = Quaternion(*out[-1,4:].tolist())
+            self.wb = wb[-1]
+
+        return out[:,:4], wb
+
+
+class MadgwickFleet:
+    """
+    K independent MARG filters updated together. The state of every filter
+    is kept in arrays (struct-of-arrays) instead of one Madgwick object
+    per vehicle:
+
+    q: [K,4] orientation quaternions (w,x,y,z)
+    qwe: [K,4] integrated gyro error
+    wb: [K,3] gyro bias estimates
+    bias: [K,3] magnetometer hard-iron offsets
+    M: [K,3,3] magnetometer soft-iron matrices
+    B, Z: filter gains, either a scalar or [K]
+    """
+    def __init__(self, K, B, Z):
+        self.q = np.zeros((K,4))
+        self.q[:,0] = 1.0
+        self.qwe = np.zeros((K,4))
+        self.wb = np.zeros((K,3))
+        self.wcomp = True
+        self.B = B
+        self.zeta = Z
+        self.bias = np.zeros((K,3))
+        self.M = np.tile(np.eye(3), (K,1,1))
+
+    def __len__(self):
+        return self.q.shape[0]
+
+    def update(self, a, g, m, dt):
+        """
+        Advances all filters one time step
+
+        a: [K,3] accelerations, any units
+        g: [K,3] gyro rates [rads/sec]
+        m: [K,3] raw magnetometer, M and bias are applied here
+        dt: time step [sec], either a scalar or [K]
+
+        returns: q [K,4]
+        """
+        a = np.asarray(a, dtype=float)
+        g = np.asarray(g, dtype=float)
+        m = np.einsum('kij,kj->ki', self.M, np.asarray(m, dtype=float) - self.bias)
+
+        ans = marg_step(
+            *self.q.T, *self.qwe.T,
+            *a.T, *g.T, *m.T,
+            dt, np.asarray(self.B), np.asarray(self.zeta), self.wcomp)
+
+        self.q[...] = np.stack(ans[:4], axis=1)
+        self.qwe[...] = np.stack(ans[4:], axis=1)
+        self.wb = np.reshape(self.zeta, (-1,1))*self.qwe[:,1:]
+        return self.q
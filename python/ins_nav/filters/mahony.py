@@ -4,83 +4,267 @@
 # see LICENSE for full details
 ##############################################
 import numpy as np
-from numpy.linalg import norm
 from squaternion import Quaternion
-from math import sqrt
+from ins_nav.backend import jitable, kernel, get_backend
+
+
+@jitable
+def mahony_imu_step(q0,q1,q2,q3, i0,i1,i2, ax,ay,az, gx,gy,gz, dt, Kp, Ki):
+    """
+    One step of Mahony's explicit complementary filter using accel and gyro
+
+    q0-q3: current orientation quaternion (w,x,y,z)
+    i0-i2: integral feedback term, gyro bias estimate is -i
+    a: acceleration, normalized here so can be in any units
+    g: gyro rates [rads/sec]
+    dt: time step [sec]
+
+    returns: q0,q1,q2,q3,i0,i1,i2
+    """
+    n = (ax*ax + ay*ay + az*az)**0.5
+    ax = ax/n; ay = ay/n; az = az/n
+
+    # estimated direction of gravity
+    vx = 2*(q1*q3 - q0*q2)
+    vy = 2*(q0*q1 + q2*q3)
+    vz = q0*q0 - q1*q1 - q2*q2 + q3*q3
+
+    # error is cross product between measured and estimated direction
+    ex = ay*vz - az*vy
+    ey = az*vx - ax*vz
+    ez = ax*vy - ay*vx
+
+    # PI feedback of the error into the gyro rates
+    i0 = i0 + Ki*ex*dt
+    i1 = i1 + Ki*ey*dt
+    i2 = i2 + Ki*ez*dt
+
+    gx = gx + Kp*ex + i0
+    gy = gy + Kp*ey + i1
+    gz = gz + Kp*ez + i2
+
+    # qdot = 0.5*q*w, then integrate
+    q0, q1, q2, q3 = (
+        q0 + 0.5*(-q1*gx - q2*gy - q3*gz)*dt,
+        q1 + 0.5*( q0*gx + q2*gz - q3*gy)*dt,
+        q2 + 0.5*( q0*gy - q1*gz + q3*gx)*dt,
+        q3 + 0.5*( q0*gz + q1*gy - q2*gx)*dt)
+
+    n = (q0*q0 + q1*q1 + q2*q2 + q3*q3)**0.5
+    return q0/n, q1/n, q2/n, q3/n, i0, i1, i2
+
+
+@jitable
+def mahony_marg_step(q0,q1,q2,q3, i0,i1,i2, ax,ay,az, gx,gy,gz, mx,my,mz, dt, Kp, Ki):
+    """
+    One step of Mahony's explicit complementary filter using accel, gyro
+    and magnetometer. The magnetometer reading must already be calibrated.
+
+    q0-q3: current orientation quaternion (w,x,y,z)
+    i0-i2: integral feedback term, gyro bias estimate is -i
+    a: acceleration, normalized here so can be in any units
+    g: gyro rates [rads/sec]
+    m: magnetometer, normalized here so can be in any units
+    dt: time step [sec]
+
+    returns: q0,q1,q2,q3,i0,i1,i2
+    """
+    n = (ax*ax + ay*ay + az*az)**0.5
+    ax = ax/n; ay = ay/n; az = az/n
+    n = (mx*mx + my*my + mz*mz)**0.5
+    mx = mx/n; my = my/n; mz = mz/n
+
+    # Earth magnetic field reference, h = q*m*q.conjugate
+    hx = (q0*q0+q1*q1-q2*q2-q3*q3)*mx + 2*(q1*q2-q0*q3)*my + 2*(q1*q3+q0*q2)*mz
+    hy = 2*(q1*q2+q0*q3)*mx + (q0*q0-q1*q1+q2*q2-q3*q3)*my + 2*(q2*q3-q0*q1)*mz
+    bz = 2*(q1*q3-q0*q2)*mx + 2*(q2*q3+q0*q1)*my + (q0*q0-q1*q1-q2*q2+q3*q3)*mz
+    bx = (hx*hx + hy*hy)**0.5
+
+    # estimated direction of gravity and magnetic field
+    vx = 2*(q1*q3 - q0*q2)
+    vy = 2*(q0*q1 + q2*q3)
+    vz = q0*q0 - q1*q1 - q2*q2 + q3*q3
+    wx = bx*(q0*q0+q1*q1-q2*q2-q3*q3) + 2*bz*(q1*q3-q0*q2)
+    wy = 2*bx*(q1*q2-q0*q3) + 2*bz*(q0*q1+q2*q3)
+    wz = 2*bx*(q0*q2+q1*q3) + bz*(q0*q0-q1*q1-q2*q2+q3*q3)
+
+    # error is sum of cross product between measured and estimated direction
+    ex = (ay*vz - az*vy) + (my*wz - mz*wy)
+    ey = (az*vx - ax*vz) + (mz*wx - mx*wz)
+    ez = (ax*vy - ay*vx) + (mx*wy - my*wx)
+
+    # PI feedback of the error into the gyro rates
+    i0 = i0 + Ki*ex*dt
+    i1 = i1 + Ki*ey*dt
+    i2 = i2 + Ki*ez*dt
+
+    gx = gx + Kp*ex + i0
+    gy = gy + Kp*ey + i1
+    gz = gz + Kp*ez + i2
+
+    # qdot = 0.5*q*w, then integrate
+    q0, q1, q2, q3 = (
+        q0 + 0.5*(-q1*gx - q2*gy - q3*gz)*dt,
+        q1 + 0.5*( q0*gx + q2*gz - q3*gy)*dt,
+        q2 + 0.5*( q0*gy - q1*gz + q3*gx)*dt,
+        q3 + 0.5*( q0*gz + q1*gy - q2*gx)*dt)
+
+    n = (q0*q0 + q1*q1 + q2*q2 + q3*q3)**0.5
+    return q0/n, q1/n, q2/n, q3/n, i0, i1, i2
+
+
+@jitable
+def mahony_imu_replay(q0,q1,q2,q3, i0,i1,i2, accel, gyro, dt, Kp, Ki, out):
+    """
+    Runs mahony_imu_step() over a whole log, out[i] is (q0..q3,i0..i2)
+    after sample i. The inputs are either [N,3] arrays or lists of lists.
+    """
+    for i in range(len(dt)):
+        a = accel[i]
+        g = gyro[i]
+        q0,q1,q2,q3,i0,i1,i2 = mahony_imu_step(
+            q0,q1,q2,q3, i0,i1,i2,
+            a[0],a[1],a[2], g[0],g[1],g[2],
+            dt[i], Kp, Ki)
+        out[i,0] = q0; out[i,1] = q1; out[i,2] = q2; out[i,3] = q3
+        out[i,4] = i0; out[i,5] = i1; out[i,6] = i2
+
+
+@jitable
+def mahony_marg_replay(q0,q1,q2,q3, i0,i1,i2, accel, gyro, mag, dt, Kp, Ki, out):
+    """
+    Runs mahony_marg_step() over a whole log, out[i] is (q0..q3,i0..i2)
+    after sample i. The inputs are either [N,3] arrays or lists of lists.
+    """
+    for i in range(len(dt)):
+        a = accel[i]
+        g = gyro[i]
+        m = mag[i]
+        q0,q1,q2,q3,i0,i1,i2 = mahony_marg_step(
+            q0,q1,q2,q3, i0,i1,i2,
+            a[0],a[1],a[2], g[0],g[1],g[2], m[0],m[1],m[2],
+            dt[i], Kp, Ki)
+        out[i,0] = q0; out[i,1] = q1; out[i,2] = q2; out[i,3] = q3
+        out[i,4] = i0; out[i,5] = i1; out[i,6] = i2
+
 
 class Mahony:
     """
-    IMU filter
-    ref: Madgwick, An efficient orientation filter for inertial
-        and inertial/magnetic sensor arrays
+    Mahony's explicit complementary filter. The error between the measured
+    and estimated gravity (and magnetic field) directions is fed back into
+    the gyro rates through a proportional-integral controller. The integral
+    term estimates the gyro bias.
+
+    Kp: proportional gain
+    Ki: integral gain, 0 turns off gyro bias estimation
+    q: [optional] initial quaternion, otherwise [1,0,0,0]
+    bias: magnetometer hard-iron offsets (x,y,z)
+    M: magnetometer soft-iron matrix as 3 rows ((..),(..),(..))
+
+    ref: Mahony, Hamel, Pflimlin, Nonlinear complementary filters on
+        the special orthogonal group
     """
-    def __init__(self, B, q=None):
-        """
-        q: [optional] initial quaternion, otherwise [1,0,0,0]
-        B: Beta term in Madgwick's paper based on filter gradient learning
-        """
-        self.wb = np.array([0,0,0])
-        self.wcomp = True # estimate gyro bias
-        self.wdr = 0.2 # gyro drift rate deg/sec/sec
+    __slots__ = (
+        "Kp", "Ki", "bias", "M",
+        "q0", "q1", "q2", "q3",
+        "i0", "i1", "i2")
+
+    def __init__(self, Kp, Ki=0.0, q=None):
+        self.Kp = Kp
+        self.Ki = Ki
+        self.bias = (0.0, 0.0, 0.0)
+        self.M = ((1.0, 0.0, 0.0), (0.0, 1.0, 0.0), (0.0, 0.0, 1.0))
+        self.reset(q)
 
+    def reset(self, q=None):
+        """Resets the orientation and gyro bias estimate"""
         if q is None:
-            self.q = Quaternion()
-        else:
-            self.q = q
+            q = (1.0, 0.0, 0.0, 0.0)
+        self.q0, self.q1, self.q2, self.q3 = (float(x) for x in q)
+        self.i0 = self.i1 = self.i2 = 0.0
 
-        self.B = B
+    @property
+    def q(self):
+        return Quaternion(self.q0, self.q1, self.q2, self.q3)
 
-    def comp(self, del_f, dt):
-        """
-        Does the gyro compensation
-        """
-        q = self.q
-        zeta = sqrt(3/4)*self.wdr*pi/180 # gyro drift: rad/s/s
-        qwe = 2.0*q.conjugate*del_f # 47
-        qwe = qwe.normalize
-        self.wb = self.wb + zeta*np.array(qwe[1:])*dt # 48
-        return self.wb
-
-    def grad(self, a):
-        """
-        Calculates eqn #34, del_f/norm(del_f), which is the top
-        block in the IMU flow diagram.
-        """
-        ax,ay,az = a
-        q1,q2,q3,q4 = self.q
-
-        fg = np.array([
-            [2*(q2*q4-q1*q3)-ax],
-            [2*(q1*q2+q3*q4)-ay],
-            [2*(0.5-q2**2-q3**2)-az]
-        ]) # 25
-        Jg = np.array([
-            [-2*q3,  2*q4, -2*q1, 2*q2],
-            [ 2*q2,  2*q1,  2*q4, 2*q3],
-            [    0, -4*q2, -4*q3,    0]
-        ]) # 26, gradient of fg
-
-        d = (Jg.T @ fg).T
-        d = d.ravel()
-        qq = Quaternion(*d).normalize
-        return qq.normalize
-
-    def update(self, a, w, dt):
+    @property
+    def wb(self):
+        """Gyro bias estimate [rads/sec]"""
+        return (-self.i0, -self.i1, -self.i2,)
+
+    def update(self, a, g, dt, m=None):
         """
         a: acceleration, term is normalize, so can be in any units
-        w: gyro rates [rads/sec]
+        g: gyro rates [rads/sec]
         dt: time step [sec]
+        m: [optional] raw magnetometer, M and bias are applied here
+
+        returns: q as tuple (w,x,y,z)
         """
-        a = a/norm(a)
-        q = self.q
-        del_f = self.grad(a) # gradient decent algorithm
-
-        if self.wcomp:
-            wb = self.comp(del_f,dt) # calculate bias
-            w = w - wb               # 49
-
-        qdw = 0.5*q*Quaternion(0,*w)
-        qdot = qdw - self.B*del_f # filter
-        q = q + qdot*dt           # integrate
-        self.q = q.normalize
-        return self.q
+        if m is None:
+            (self.q0, self.q1, self.q2, self.q3,
+             self.i0, self.i1, self.i2) = kernel(mahony_imu_step)(
+                self.q0, self.q1, self.q2, self.q3,
+                self.i0, self.i1, self.i2,
+                a[0], a[1], a[2], g[0], g[1], g[2],
+                dt, self.Kp, self.Ki)
+        else:
+            bx, by, bz = self.bias
+            (m11, m12, m13), (m21, m22, m23), (m31, m32, m33) = self.M
+            mx = m[0] - bx
+            my = m[1] - by
+            mz = m[2] - bz
+
+            (self.q0, self.q1, self.q2, self.q3,
+             self.i0, self.i1, self.i2) = kernel(mahony_marg_step)(
+                self.q0, self.q1, self.q2, self.q3,
+                self.i0, self.i1, self.i2,
+                a[0], a[1], a[2], g[0], g[1], g[2],
+                m11*mx + m12*my + m13*mz,
+                m21*mx + m22*my + m23*mz,
+                m31*mx + m32*my + m33*mz,
+                dt, self.Kp, self.Ki)
+
+        return (self.q0, self.q1, self.q2, self.q3,)
+
+    def run(self, accel, gyro, dt, mag=None):
+        """
+        Replays a whole sensor log through the filter, starting from the
+        current state. The filter state is left at the last sample.
+
+        accel: [N,3] accelerations, any units
+        gyro: [N,3] gyro rates [rads/sec]
+        dt: time step [sec], either a scalar or [N]
+        mag: [optional] [N,3] raw magnetometer, M and bias are applied here
+
+        returns: q [N,4] quaternions (w,x,y,z), wb [N,3] gyro bias estimates
+        """
+        accel = np.asarray(accel, dtype=float)
+        gyro = np.asarray(gyro, dtype=float)
+        N = accel.shape[0]
+        dt = np.broadcast_to(np.asarray(dt, dtype=float), (N,))
+
+        out = np.empty((N,7))
+
+        if mag is not None:
+            mag = (np.asarray(mag, dtype=float) - self.bias) @ np.asarray(self.M).T
+
+        if get_backend() == "python":
+            # python floats are much faster than numpy scalars in this loop
+            accel, gyro, dt = accel.tolist(), gyro.tolist(), dt.tolist()
+            if mag is not None:
+                mag = mag.tolist()
+        else:
+            dt = np.ascontiguousarray(dt)
+
+        state = (self.q0, self.q1, self.q2, self.q3, self.i0, self.i1, self.i2)
+        if mag is None:
+            kernel(mahony_imu_replay)(*state, accel, gyro, dt, self.Kp, self.Ki, out)
+        else:
+            kernel(mahony_marg_replay)(*state, accel, gyro, mag, dt, self.Kp, self.Ki, out)
+
+        if N > 0:
+            (self.q0, self.q1, self.q2, self.q3,
+             self.i0, self.i1, self.i2) = out[-1].tolist()
+
+        return out[:,:4], -out[:,4:]
@@ -0,0 +1,152 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+from functools import lru_cache
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from ins_nav.storage import from_pickle
+from ins_nav.filters.madgwick import Madgwick
+from ins_nav.backend import set_backend, get_backend
+
+# a worker's logs, set once per process by _init_worker(): the sweep's
+# list of logs, in-memory ones already loaded, and the file loader
+_srcs = None
+_cached_log = None
+
+
+def load_log(src):
+    """
+    Returns a log as a dict of arrays: accel, gyro, mag [N,3], dt [N] and
+    optionally q [N,4] reference attitude (w,x,y,z).
+
+    src: a dict like the above, or a pickle file/dict from the data logger,
+        where data is [N,11]: accel, gyro, mag, temperature, timestamp [usec]
+    """
+    if isinstance(src, dict):
+        log = src
+    else:
+        log = from_pickle(src)
+
+    if "data" in log:
+        data = np.array(log["data"], dtype=float)
+        stamp = data[:,-1] / 1E6
+        log = {
+            "accel": data[:,0:3],
+            "gyro": data[:,3:6],
+            "mag": data[:,6:9],
+            "dt": np.diff(stamp, prepend=stamp[0]),
+            "q": log.get("q", None)
+        }
+
+    return log
+
+
+def _init_worker(logs, cache, backend):
+    """
+    Pool initializer, so in-memory logs are sent to each worker once
+    instead of with every task, and only the cache most recently used
+    log files stay loaded
+    """
+    global _srcs, _cached_log
+    set_backend(backend)
+    _srcs = [load_log(src) if isinstance(src, dict) else src for src in logs]
+    _cached_log = lru_cache(maxsize=cache)(load_log)
+
+
+def _get_log(index):
+    src = _srcs[index]
+    return src if isinstance(src, dict) else _cached_log(src)
+
+
+def attitude_error(q, ref):
+    """
+    Angle between two sets of quaternions [N,4], returns [N] degrees
+    """
+    d = np.abs(np.sum(q*ref, axis=1))
+    return 2*np.arccos(np.minimum(d, 1.0))*180/np.pi
+
+
+def settle_time(wb, dt, tol):
+    """
+    Time [sec] after which the gyro bias estimate wb [N,3] stays within
+    tol [rads/sec] of its final value
+    """
+    err = np.linalg.norm(wb - wb[-1], axis=1)
+    bad = np.nonzero(err > tol)[0]
+    if len(bad) == 0:
+        return 0.0
+    return float(np.sum(dt[:bad[-1]+1]))
+
+
+def _run_chunk(args):
+    """Worker: runs one log against a chunk of (B, Z) grid points"""
+    index, points, bias_tol = args
+    log = _get_log(index)
+    ref = log.get("q", None)
+
+    rows = []
+    for B, Z in points:
+        f = Madgwick(B, Z)
+        q, wb = f.run(log["accel"], log["gyro"], log["mag"], log["dt"])
+
+        if ref is None:
+            rms = mx = np.nan
+        else:
+            err = attitude_error(q, np.asarray(ref))
+            rms = np.sqrt(np.mean(err**2))
+            mx = np.max(err)
+
+        rows.append((index, B, Z, rms, mx, settle_time(wb, log["dt"], bias_tol)))
+    return rows
+
+
+SWEEP_DTYPE = [
+    ("log", int),      # index into the logs passed to sweep()
+    ("B", float),
+    ("Z", float),
+    ("rms", float),    # rms attitude error [deg]
+    ("max", float),    # max attitude error [deg]
+    ("settle", float)  # gyro bias convergence time [sec]
+]
+
+
+def sweep(logs, grid, workers=None, chunk=16, bias_tol=1e-3, cache=4):
+    """
+    Runs the Madgwick filter over every log for every combination of gains
+    in grid, fanning the runs out over a process pool.
+
+    logs: list of pickle files or log dicts, see load_log()
+    grid: {"B": [...], "Z": [...]}
+    workers: number of processes, None uses all cores, 0 runs in this process
+    chunk: number of grid points each task runs, a worker loads a log
+        file only once and then reuses it for every chunk it gets
+    bias_tol: gyro bias convergence tolerance [rads/sec]
+    cache: number of log files each worker keeps loaded
+
+    returns: numpy structured array with one row per (log, B, Z), see
+        SWEEP_DTYPE. Sort with np.sort(table, order="rms")
+    """
+    global _srcs, _cached_log
+    logs = list(logs)
+    points = list(product(grid["B"], grid["Z"]))
+    init = (logs, cache, get_backend())
+    tasks = [
+        (i, points[j:j+chunk], bias_tol)
+        for i in range(len(logs))
+        for j in range(0, len(points), chunk)
+    ]
+
+    if workers == 0:
+        _init_worker(*init)
+        try:
+            rows = [r for t in tasks for r in _run_chunk(t)]
+        finally:
+            _srcs = _cached_log = None
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init) as pool:
+            rows = [r for rr in pool.map(_run_chunk, tasks) for r in rr]
+
+    return np.array(rows, dtype=SWEEP_DTYPE)
@@ -6,12 +6,21 @@
 
 # from math import sin, pi
 import numpy as np
+from collections import OrderedDict, namedtuple
+from threading import Lock
 from numpy.linalg import norm
 from numpy import arcsin, cos, sin, pi, sqrt, arcsin as asin, arctan2
+from ins_nav.wgs84 import WGS84
+from ins_nav.offsets import ECEFOffsets
 
 deg2rad = np.pi/180
 rad2deg = 180/np.pi
 
+wgs = WGS84()
+
+# bound on the flat earth error relative to its leading terms
+FLAT_MARGIN = 1.25
+
 class NavigationFrame:
     """
     Converts between ENU <-> ECEF <-> NED
@@ -36,145 +45,280 @@ class NavigationFrame:
         """
         self.latr = llref[0]*deg2rad
         self.lonr = llref[1]*deg2rad
-        self.ecefr = self.__llh2ecef(llref)
+        self.ecefr = wgs.llh2ecef(llref)
+        self.llref = (float(llref[0]), float(llref[1]), float(llref[2]) if len(llref) > 2 else 0.0)
+
+        # the origin never changes, so all of the rotations are done once
+        slat = sin(self.latr); clat = cos(self.latr)
+        slon = sin(self.lonr); clon = cos(self.lonr)
+
+        # ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#From_ECEF_to_ENU
+        self.R_ecef2enu = np.array([
+            [     -slon,       clon,    0],
+            [-slat*clon, -slat*slon, clat],
+            [ clat*clon,  clat*slon, slat]
+        ])
+        self.R_enu2ecef = self.R_ecef2enu.T.copy()
+
+        # ref: https://en.wikipedia.org/wiki/Local_tangent_plane_coordinates
+        self.R_ned2ecef = np.array([
+            [-slat*clon, -slon, -clat*clon],
+            [-slat*slon,  clon, -clat*slon],
+            [      clat,     0,      -slat]
+        ])
+        self.R_ecef2ned = self.R_ned2ecef.T.copy()
+
+        # R(ecef - ref) = R*ecef - R*ref, so no temporary is needed
+        self.enu_offset = -self.R_ecef2enu.dot(self.ecefr)
+        self.ned_offset = -self.R_ecef2ned.dot(self.ecefr)
 
         # this matrix converts ned <-> enu
         # notice R == R.T, so no need to transpose it
         self.R = np.array([
-            [0,1,0],
-            [1,0,0],
-            [0,0,-1]
+            [0.,1.,0.],
+            [1.,0.,0.],
+            [0.,0.,-1.]
         ])
 
-    def __llh2ecef(self, lla):
+        # flat earth: meridian (M) and prime vertical (N) radii at the origin
+        h0 = self.llref[2]
+        e2 = wgs.e2
+        w = 1.0 - e2*slat**2
+        M = wgs.a*(1 - e2) / w**1.5
+        N = wgs.a / sqrt(w)
+        self.flat_north = (M + h0)*deg2rad       # [m/deg]
+        self.flat_east = (N + h0)*clat*deg2rad   # [m/deg]
+
+        # error of the flat earth approximation at horizontal distance d
+        # and height difference dh is about (d^2 (1+|tan(lat)|)/2 + d|dh|)/R,
+        # FLAT_MARGIN covers what that leaves out (checked to 89.5 deg)
+        R = sqrt(M*N)
+        self.flat_k = FLAT_MARGIN*(1 + abs(slat/clat))/(2*R) if clat > 1e-12 else np.inf
+        self.flat_c = FLAT_MARGIN/R
+
+    @staticmethod
+    def _apply(R, p, offset, out):
+        """Returns p R^T + offset where p is [3] or [N,3] points"""
+        out = np.matmul(p, R.T, out=out)
+        if offset is not None:
+            out += offset
+        return out
+
+    def _apply_offsets(self, R, p, out):
         """
-        Geodetic coordinates are a type of curvilinear orthogonal coordinate
-        system used in geodesy based on a reference ellipsoid. They include
-        geodetic latitude (north/south) phi, longitude (east/west) lambda, and
-        ellipsoidal height h (also known as geodetic height). The triad
-        is also known as Earth ellipsoidal coordinates
-        https://en.wikipedia.org/wiki/Geodetic_coordinates
-
-        llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
-        ecef: Earth Centered Earth Fixed in [m, m, m]
-
-        ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion
+        Same as _apply for ECEFOffsets, R(origin + d - ref) = R d + R(origin - ref)
+        so the float32 offsets are rotated as is
         """
-        lat = lla[0] *deg2rad
-        lon = lla[1] * deg2rad
-
-        if len(lla) == 2:
-            H = 0
-        else:
-            H = lla[2]
-
-        a  = 6378137.0        # Semi major axis of Earth [m]
-        e2 = 0.00669437999014 # Eccentricity of Earth ellipsoid squared
-        n = a / sqrt(1.0 - e2 * sin(lat)**2)
-
-        x = (n + H) * cos(lat) * cos(lon)
-        y = (n + H) * cos(lat) * sin(lon)
-        z = ((1 - e2) * n + H) * sin(lat)
+        out = np.matmul(p.offsets, R.T, out=out, dtype=np.float64)
+        out += R.dot(p.origin - self.ecefr)
+        return out
 
-        return np.array([x, y, z])
-
-    def ecef2enu(self, ecef):
+    def ecef2enu(self, ecef, out=None):
         """
+        ecef: Earth Centered Earth Fixed in [m, m, m], [3] or [N,3], or
+            ECEFOffsets
+        enu: East, North, Up in [m, m, m], [3] or [N,3]
+        out: [optional] array to put the answer in
+
         ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#From_ECEF_to_ENU
         """
-        lat = self.latr
-        lon = self.lonr
-        ref = self.ecefr
-
-        slat = sin(lat); clat = cos(lat)
-        slon = sin(lon); clon = cos(lon)
+        if isinstance(ecef, ECEFOffsets):
+            return self._apply_offsets(self.R_ecef2enu, ecef, out)
+        return self._apply(self.R_ecef2enu, ecef, self.enu_offset, out)
 
-        # FIXME: get rid of trig calls
-        r = np.array([
-            [-sin(lon),                    cos(lon),        0],
-            [-sin(lat)*cos(lon), -sin(lat)*sin(lon), cos(lat)],
-            [ cos(lat)*cos(lon),  cos(lat)*sin(lon), sin(lat)]
-        ])
-
-        return r.dot(ecef - ref)
-
-    def enu2ecef(self, enu):
+    def enu2ecef(self, enu, out=None):
         """
+        enu: East, North, Up in [m, m, m], [3] or [N,3]
+        ecef: Earth Centered Earth Fixed in [m, m, m], [3] or [N,3]
+        out: [optional] array to put the answer in
+
         ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#From_ENU_to_ECEF
         """
-        lat = self.latr
-        lon = self.lonr
-        ref = self.ecefr
-
-        slat = sin(lat); clat = cos(lat)
-        slon = sin(lon); clon = cos(lon)
+        return self._apply(self.R_enu2ecef, enu, self.ecefr, out)
 
-        r = np.array([
-            [-slon, -slat*clon, clat*clon],
-            [ clat, -slat*slon, clat*slon],
-            [    0,       clat,      slat]
-        ])
-
-        return r.dot(enu) + ref
-
-    def ecef2ned(self, ecef):
+    def ecef2ned(self, ecef, out=None):
         """
-        llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
-        ecef: Earth Centered Earth Fixed in [m, m, m]
-        ned: North, East, Down in [m, m, m]
+        ecef: Earth Centered Earth Fixed in [m, m, m], [3] or [N,3], or
+            ECEFOffsets
+        ned: North, East, Down in [m, m, m], [3] or [N,3]
+        out: [optional] array to put the answer in
 
         ref: https://en.wikipedia.org/wiki/Local_tangent_plane_coordinates
         """
-        lat = self.latr
-        lon = self.lonr
-        ref = self.ecefr
+        if isinstance(ecef, ECEFOffsets):
+            return self._apply_offsets(self.R_ecef2ned, ecef, out)
+        return self._apply(self.R_ecef2ned, ecef, self.ned_offset, out)
 
-        slat = sin(lat); clat = cos(lat)
-        slon = sin(lon); clon = cos(lon)
+    def ned2ecef(self, ned, out=None):
+        """
+        ned: North, East, Down in [m, m, m], [3] or [N,3]
+        ecef: Earth Centered Earth Fixed in [m, m, m], [3] or [N,3]
+        out: [optional] array to put the answer in
 
-        #     R = np.array(
-        #         [
-        #             [-np.sin(lat)*np.cos(lon), -np.sin(lat)*np.sin(lon), np.cos(lat)],
-        #             [-np.sin(lon), np.cos(lon), 0],
-        #             [-np.cos(lat)*np.cos(lon), -np.cos(lat)*np.sin(lon), -np.sin(lat)]
-        #         ]
-        #     )
+        ref: https://en.wikipedia.org/wiki/Local_tangent_plane_coordinates
+        """
+        return self._apply(self.R_ned2ecef, ned, self.ecefr, out)
 
-        # FIXME: get rid of transpose
-        r = np.array([
-            [-slat*clon, -slon, -clat*clon],
-            [-slat*slon,  clon, -clat*slon],
-            [      clat,     0,      -slat]
-        ]).T
+    def ned2enu(self, ned, out=None):
+        return self._apply(self.R, ned, None, out)
 
-        return r.dot(ecef - ref)
+    def enu2ned(self, enu, out=None):
+        return self._apply(self.R, enu, None, out)
 
-    def ned2ecef(self, ned):
+    def flat_radius(self, tol, dh=0.0):
         """
-        llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
-        ecef: Earth Centered Earth Fixed in [m, m, m]
-        ned: North, East, Down in [m, m, m]
+        Horizontal distance [m] from the origin out to which the flat earth
+        approximation stays within tol.
 
-        ref: https://en.wikipedia.org/wiki/Local_tangent_plane_coordinates
+        tol: max position error [m]
+        dh: height difference from the origin [m]
         """
-        lat = self.latr
-        lon = self.lonr
-        ref = self.ecefr
-
-        slat = sin(lat); clat = cos(lat)
-        slon = sin(lon); clon = cos(lon)
+        k, c = self.flat_k, self.flat_c*abs(dh)
+        if not np.isfinite(k):
+            return 0.0
+        return float((-c + sqrt(c*c + 4*k*tol)) / (2*k))
+
+    def _llh2local(self, llh, tol, out, enu):
+        exact = self.ecef2enu if enu else self.ecef2ned
+        if tol is None:
+            return exact(wgs.llh2ecef(llh), out=out)
+
+        llh = np.asarray(llh, dtype=float)
+        lat0, lon0, h0 = self.llref
+
+        if llh.ndim == 1:
+            # one fix, plain floats are much faster than numpy here
+            lat, lon = llh[:2].tolist()
+            h = float(llh[2]) if len(llh) > 2 else 0.0
+            n = (lat - lat0)*self.flat_north
+            e = ((lon - lon0 + 180) % 360 - 180)*self.flat_east
+            dh = h - h0
+            d = (n*n + e*e)**0.5
+            if self.flat_k*d*d + self.flat_c*d*abs(dh) > tol:
+                return exact(wgs.llh2ecef(llh), out=out)
+            if out is None:
+                out = np.empty(3)
+            out[:] = (e, n, dh) if enu else (n, e, -dh)
+            return out
+
+        n = llh[:,0] - lat0
+        n *= self.flat_north
+        e = llh[:,1] - lon0
+        if lon0 > 170 or lon0 < -170:
+            e += 180
+            e %= 360
+            e -= 180
+        e *= self.flat_east
+        dh = llh[:,2] - h0 if llh.shape[-1] > 2 else np.full_like(n, -h0)
+
+        if out is None:
+            out = np.empty((len(llh), 3))
+        if enu:
+            out[:,0] = e; out[:,1] = n; out[:,2] = dh
+        else:
+            out[:,0] = n; out[:,1] = e; np.negative(dh, out=out[:,2])
+
+        # points where the approximation could be off by more than tol
+        # take the exact path, the radius is for the largest height change
+        r = self.flat_radius(tol, np.max(np.abs(dh)) if len(dh) else 0.0)
+        n *= n
+        e *= e
+        n += e
+        bad = n > r*r
+        if bad.any():
+            out[bad] = exact(wgs.llh2ecef(llh[bad]))
+        return out
+
+    def llh2ned(self, llh, tol=None, out=None):
+        """
+        llh: latitude, longitude, height in [deg, deg, m], [3] or [N,3]
+            (height can be left off, [2] or [N,2])
+        tol: [optional] allowed position error [m]. If given, points are
+            converted with a flat earth approximation using the meridian and
+            prime vertical radii at the origin, which is much faster, and
+            only the points where the error could be more than tol (see
+            flat_radius()) use the exact ECEF path. None is always exact.
+        out: [optional] array to put the answer in
+        returns: ned [3] or [N,3]
+        """
+        return self._llh2local(llh, tol, out, False)
 
-        r = np.array([
-            [-slat*clon, -slon, -clat*clon],
-            [-slat*slon,  clon, -clat*slon],
-            [      clat,     0,      -slat]
-        ])
+    def llh2enu(self, llh, tol=None, out=None):
+        """
+        Same as llh2ned(), but returns enu [3] or [N,3]
+        """
+        return self._llh2local(llh, tol, out, True)
 
-        return r.dot(ned) + ref
 
-    def ned2enu(self, ned):
-        return self.R.dot(ned)
+CacheInfo = namedtuple("CacheInfo", "hits misses maxsize size")
 
-    def enu2ned(self, enu):
-        return self.R.dot(enu)
 
+class FrameCache:
+    """
+    Keeps the most recently used NavigationFrames so callers that share
+    an origin also share the frame instead of building a new one each time.
+    Origins are rounded before lookup, so nearly identical origins map to
+    one frame built at the rounded origin.
+
+    frames = FrameCache(maxsize=1024)
+    f = frames.get((40.0001, -90.0002, 100))
+    frames.info()  # CacheInfo(hits, misses, maxsize, size)
+
+    maxsize: max number of frames kept, least recently used is dropped
+    digits: lat/lon are rounded to this many decimal places, 7 is ~1cm
+    alt_digits: altitude is rounded to this many decimal places
+    """
+    def __init__(self, maxsize=128, digits=7, alt_digits=2):
+        self.maxsize = maxsize
+        self.digits = digits
+        self.alt_digits = alt_digits
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def key(self, llref):
+        """Returns the rounded origin (lat, lon, alt) used as the key"""
+        alt = llref[2] if len(llref) > 2 else 0.0
+        return (
+            round(float(llref[0]), self.digits),
+            round(float(llref[1]), self.digits),
+            round(float(alt), self.alt_digits))
+
+    def get(self, llref):
+        """
+        llref: (lat, lon) or (lat, lon, alt) of the frame origin
+        returns: NavigationFrame
+        """
+        key = self.key(llref)
+        with self.lock:
+            frame = self.frames.get(key, None)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return frame
+            self.misses += 1
+
+        frame = NavigationFrame(key)
+
+        with self.lock:
+            self.frames[key] = frame
+            self.frames.move_to_end(key)
+            while len(self.frames) > self.maxsize:
+                self.frames.popitem(last=False)
+        return frame
+
+    __call__ = get
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.frames))
+
+    def clear(self):
+        """Drops all frames and resets the statistics"""
+        with self.lock:
+            self.frames.clear()
+            self.hits = 0
+            self.misses = 0
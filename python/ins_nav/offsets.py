@@ -0,0 +1,123 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+
+
+class ECEFOffsets:
+    """
+    Compact ECEF coordinates: a float64 origin plus float32 offsets from
+    it, half the memory of float64 ECEF. ECEF values are ~6.4e6 m so plain
+    float32 only resolves ~0.5 m, but offsets within ~10 km of the origin
+    keep ~1 mm (see resolution).
+
+    WGS84.ecef2llh() and NavigationFrame.ecef2enu()/ecef2ned() take these
+    directly.
+
+    pts = ECEFOffsets.from_llh(track)   # [N,3] lat, lon, alt
+    pts = ECEFOffsets.from_ned(frame, ned)
+    frame.ecef2ned(pts)
+    pts.ecef()                          # back to float64 [N,3]
+
+    origin: [3] ECEF reference point [m]
+    offsets: [N,3] offsets from origin [m], stored as float32
+    """
+    def __init__(self, origin, offsets):
+        self.origin = np.array(origin, dtype=np.float64).reshape(3)
+        self.offsets = np.asarray(offsets, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        """Slices/indexes the points, returns ECEFOffsets"""
+        return ECEFOffsets(self.origin, np.atleast_2d(self.offsets[i]))
+
+    @property
+    def shape(self):
+        return self.offsets.shape
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.origin.nbytes
+
+    @property
+    def resolution(self):
+        """Largest rounding error [m] of the stored points"""
+        if len(self.offsets) == 0:
+            return 0.0
+        return float(np.spacing(np.abs(self.offsets).max()))/2
+
+    def columns(self):
+        """Returns x, y, z as float64 [N] each"""
+        return tuple(
+            np.add(self.offsets[:,i], self.origin[i], dtype=np.float64)
+            for i in range(3))
+
+    def ecef(self, out=None):
+        """Returns float64 ECEF [N,3] [m]"""
+        return np.add(self.offsets, self.origin, out=out, dtype=np.float64)
+
+    @classmethod
+    def from_ecef(cls, ecef, origin=None, chunk=1<<16):
+        """
+        ecef: [N,3] float64 ECEF [m]
+        origin: [optional] reference point, otherwise the center of the
+            points' bounding box which keeps the offsets smallest
+        chunk: rows converted at a time, so no float64 temporary of the
+            whole array is made
+        """
+        ecef = np.asarray(ecef, dtype=np.float64).reshape(-1, 3)
+        if origin is None:
+            origin = (ecef.min(axis=0) + ecef.max(axis=0))/2 if len(ecef) else np.zeros(3)
+        origin = np.asarray(origin, dtype=np.float64)
+
+        offsets = np.empty(ecef.shape, dtype=np.float32)
+        for i in range(0, len(ecef), chunk):
+            np.subtract(ecef[i:i+chunk], origin, out=offsets[i:i+chunk], casting="same_kind")
+        return cls(origin, offsets)
+
+    @classmethod
+    def from_llh(cls, llh, origin=None, wgs=None, chunk=1<<16):
+        """
+        llh: [N,3] lat, lon, alt [deg, deg, m], converted chunk rows at a
+            time with WGS84.llh2ecef()
+        origin: [optional] ECEF reference point, otherwise the first
+            point's ECEF
+        """
+        if wgs is None:
+            from ins_nav.wgs84 import WGS84
+            wgs = WGS84()
+
+        llh = np.asarray(llh, dtype=np.float64)
+        llh = llh.reshape(-1, llh.shape[-1])
+        if origin is None:
+            origin = wgs.llh2ecef(llh[0]) if len(llh) else np.zeros(3)
+        origin = np.asarray(origin, dtype=np.float64)
+
+        offsets = np.empty((len(llh), 3), dtype=np.float32)
+        for i in range(0, len(llh), chunk):
+            ecef = wgs.llh2ecef(llh[i:i+chunk])
+            np.subtract(ecef, origin, out=offsets[i:i+chunk], casting="same_kind")
+        return cls(origin, offsets)
+
+    @classmethod
+    def _from_local(cls, frame, R, p):
+        # the frame origin becomes the reference point, so no large
+        # numbers are involved at all
+        p = np.asarray(p).reshape(-1, 3)
+        offsets = np.empty(p.shape, dtype=np.float32)
+        np.matmul(p, R.T, out=offsets, casting="same_kind")
+        return cls(frame.ecefr, offsets)
+
+    @classmethod
+    def from_ned(cls, frame, ned):
+        """ned: [N,3] points in the NavigationFrame frame [m]"""
+        return cls._from_local(frame, frame.R_ned2ecef, ned)
+
+    @classmethod
+    def from_enu(cls, frame, enu):
+        """enu: [N,3] points in the NavigationFrame frame [m]"""
+        return cls._from_local(frame, frame.R_enu2ecef, enu)
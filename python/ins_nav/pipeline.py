@@ -0,0 +1,205 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+from abc import ABC, abstractmethod
+from itertools import islice
+from ins_nav.filters.madgwick import Madgwick
+from ins_nav.filters.mahony import Mahony
+from ins_nav.utils import rad2deg
+
+
+def batch(samples, size):
+    """
+    Groups an iterator of timestamped samples (t, accel, gyro, mag) into
+    chunks, dicts of arrays: t [n], accel, gyro, mag [n,3]. Only one
+    chunk is ever held in memory.
+    """
+    samples = iter(samples)
+    while True:
+        rows = list(islice(samples, size))
+        if len(rows) == 0:
+            return
+        t, a, g, m = zip(*rows)
+        yield {
+            "t": np.array(t, dtype=float),
+            "accel": np.array(a, dtype=float),
+            "gyro": np.array(g, dtype=float),
+            "mag": np.array(m, dtype=float)
+        }
+
+
+class Pipeline:
+    """
+    A chain of stages that lazily processes a stream of sensor samples.
+
+    pipe = calibrate(mag_cal=(A,b)) | madgwick(B, Z) | to_euler()
+
+    for t, (roll, pitch, yaw) in pipe(samples):
+        ...
+
+    samples: any iterator of (t, accel, gyro, mag), t in seconds
+    chunk: samples are pulled in chunks of this size so every stage can
+        work on arrays, memory stays bounded by the chunk size
+
+    Each call is a new stream: the stages are reset() first, so logs can
+    be run back to back through the same pipeline.
+    """
+    def __init__(self, *stages, chunk=1024):
+        # pipelines given as stages are flattened, so (a | b) | (c | d)
+        # is the same as a | b | c | d
+        self.stages = []
+        for stage in stages:
+            if isinstance(stage, Pipeline):
+                self.stages.extend(stage.stages)
+            else:
+                self.stages.append(stage)
+        self.chunk = chunk
+
+    def __or__(self, stage):
+        return Pipeline(*self.stages, stage, chunk=self.chunk)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def chunks(self, samples):
+        """Yields the processed chunks, dicts of arrays"""
+        self.reset()
+        for c in batch(samples, self.chunk):
+            for stage in self.stages:
+                c = stage.process(c)
+            yield c
+
+    def __call__(self, samples):
+        """Yields (t, value) per sample, value is the last stage's output"""
+        key = self.stages[-1].key
+        for c in self.chunks(samples):
+            yield from zip(c["t"].tolist(), c[key].tolist())
+
+
+class Stage(ABC):
+    """
+    Base class for a pipeline stage. process() takes a chunk (dict of
+    arrays), adds/replaces its output and returns it. key is the name of
+    the stage's output in the chunk. reset() clears anything kept from
+    one chunk to the next before a new stream starts.
+    """
+    key = None
+
+    def __or__(self, stage):
+        return Pipeline(self) | stage
+
+    def __call__(self, samples):
+        return Pipeline(self)(samples)
+
+    def reset(self):
+        pass
+
+    @abstractmethod
+    def process(self, chunk):
+        pass
+
+
+class Calibrate(Stage):
+    """
+    Applies sensor calibrations
+
+    mag_cal: (A, b) from magcal() or ellipsoid_fit(), m = A @ (m - b)
+    accel_cal: [4,3] from accelcal(), a = [a|1] @ A
+    """
+    key = "mag"
+
+    def __init__(self, mag_cal=None, accel_cal=None):
+        self.mag_cal = mag_cal
+        self.accel_cal = accel_cal
+
+    def process(self, chunk):
+        if self.mag_cal is not None:
+            A, b = self.mag_cal
+            chunk["mag"] = (chunk["mag"] - b) @ np.asarray(A).T
+        if self.accel_cal is not None:
+            A = np.asarray(self.accel_cal)
+            chunk["accel"] = chunk["accel"] @ A[:3] + A[3]
+        return chunk
+
+
+class _FilterStage(Stage):
+    """Keeps the filter and last timestamp between chunks"""
+    key = "q"
+
+    def __init__(self, filter):
+        self.filter = filter
+        self.last = None
+
+    def reset(self):
+        # calibration and gains are kept, the attitude starts over
+        self.filter.reset()
+        self.last = None
+
+    def dt(self, t):
+        if self.last is None:
+            self.last = t[0]
+        dt = np.diff(t, prepend=self.last)
+        self.last = t[-1]
+        return dt
+
+
+class MadgwickStage(_FilterStage):
+    """Adds q [n,4] and gyro bias wb [n,3] to the chunk"""
+    def __init__(self, B, Z):
+        super().__init__(Madgwick(B, Z))
+
+    def process(self, chunk):
+        dt = self.dt(chunk["t"])
+        chunk["q"], chunk["wb"] = self.filter.run(chunk["accel"], chunk["gyro"], chunk["mag"], dt)
+        return chunk
+
+
+class MahonyStage(_FilterStage):
+    """Adds q [n,4] and gyro bias wb [n,3] to the chunk"""
+    def __init__(self, Kp, Ki=0.0, use_mag=True):
+        super().__init__(Mahony(Kp, Ki))
+        self.use_mag = use_mag
+
+    def process(self, chunk):
+        dt = self.dt(chunk["t"])
+        m = chunk["mag"] if self.use_mag else None
+        chunk["q"], chunk["wb"] = self.filter.run(chunk["accel"], chunk["gyro"], dt, m)
+        return chunk
+
+
+class ToEuler(Stage):
+    """Adds euler [n,3] (roll, pitch, yaw) from q [n,4] to the chunk"""
+    key = "euler"
+
+    def __init__(self, degrees=True):
+        self.degrees = degrees
+
+    def process(self, chunk):
+        w, x, y, z = chunk["q"].T
+
+        roll = np.arctan2(2*(w*x + y*z), 1 - 2*(x*x + y*y))
+        pitch = np.arcsin(np.clip(2*(w*y - z*x), -1, 1))
+        yaw = np.arctan2(2*(w*z + x*y), 1 - 2*(y*y + z*z))
+
+        e = np.stack((roll, pitch, yaw), axis=1)
+        if self.degrees:
+            e *= rad2deg
+        chunk["euler"] = e
+        return chunk
+
+
+def calibrate(mag_cal=None, accel_cal=None):
+    return Calibrate(mag_cal, accel_cal)
+
+def madgwick(B, Z):
+    return MadgwickStage(B, Z)
+
+def mahony(Kp, Ki=0.0, use_mag=True):
+    return MahonyStage(Kp, Ki, use_mag)
+
+def to_euler(degrees=True):
+    return ToEuler(degrees)
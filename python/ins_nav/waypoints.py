@@ -0,0 +1,279 @@
+##############################################
+# The MIT License (MIT)
+# Copyright (c) 2016 Kevin Walchko
+# see LICENSE for full details
+##############################################
+import numpy as np
+from heapq import heappush, heappop
+from math import sin, cos, pi, radians
+from ins_nav.wgs84 import WGS84
+
+
+def _unit(ll):
+    """[N,2] (lat, lon) in deg to [N,3] points on the unit sphere"""
+    lat = np.radians(ll[:,0])
+    lon = np.radians(ll[:,1])
+    c = np.cos(lat)
+    return np.column_stack((c*np.cos(lon), c*np.sin(lon), np.sin(lat)))
+
+
+def _box_near(q, lo, hi):
+    """Squared distance from q to the closest point of a box"""
+    d = 0.0
+    for x, a, b in zip(q, lo, hi):
+        if x < a:
+            d += (a - x)**2
+        elif x > b:
+            d += (x - b)**2
+    return d
+
+
+def _box_far(q, lo, hi):
+    """Squared distance from q to the farthest corner of a box"""
+    return sum(max((x - a)**2, (x - b)**2) for x, a, b in zip(q, lo, hi))
+
+
+class WaypointIndex:
+    """
+    Spatial index of waypoints for nearest and within radius queries.
+    Waypoints are kept in a KD-tree of points on the unit sphere, where
+    the straight line (chord) distance orders points exactly like the
+    haversine distance, so a query only looks at the few leaves of the
+    tree near it instead of every waypoint. Distances are haversine
+    distances [m], see WGS84.haversine().
+
+    idx = WaypointIndex(waypoints)      # [N,2] (lat, lon) in deg
+    ids, dist = idx.nearest(fix, k=3)
+    ids, dist = idx.within(fix, 500)
+    i = idx.insert((lat, lon))
+    idx.remove(i)
+
+    New waypoints are scanned directly until there are enough of them to
+    be worth rebuilding the tree, removed ones are skipped until they are
+    a large part of it, both rebuild on the next query.
+
+    points: [optional] initial waypoints [N,2] (lat, lon) in deg, height
+        is ignored if given
+    leaf: waypoints per tree leaf, they are checked as one numpy array
+    """
+    def __init__(self, points=None, leaf=32):
+        self.wgs = WGS84()
+        self.leaf = leaf
+        self.size = 0
+        self.ll = np.empty((16,2))
+        self.unit = np.empty((16,3))
+        self.alive = np.zeros(16, dtype=bool)
+        self.next = 0  # next id, ids are never reused
+        self.visited = 0  # leaves checked by the last query
+
+        self.nodes = []  # (start, stop, box lo, box hi, left, right)
+        self.tree_ids = np.empty(0, dtype=int)
+        self.tree_pts = np.empty((0,3))
+        self.pending = []  # ids inserted since the tree was built
+        self.dead = 0  # removed ids still in the tree
+
+        if points is not None:
+            self.extend(points)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return 0 <= id < self.next and bool(self.alive[id])
+
+    def __getitem__(self, id):
+        """Returns the waypoint (lat, lon) in deg"""
+        if id not in self:
+            raise KeyError(id)
+        return tuple(self.ll[id].tolist())
+
+    def _grow(self, n):
+        cap = len(self.alive)
+        if self.next + n <= cap:
+            return
+        while cap < self.next + n:
+            cap *= 2
+        for name in ("ll", "unit", "alive"):
+            old = getattr(self, name)
+            new = np.zeros((cap,) + old.shape[1:], dtype=old.dtype)
+            new[:self.next] = old[:self.next]
+            setattr(self, name, new)
+
+    def insert(self, point):
+        """
+        Adds one waypoint (lat, lon) in deg, returns its id
+        """
+        return int(self.extend([point])[0])
+
+    def extend(self, points):
+        """
+        Adds waypoints [N,2] (lat, lon) in deg, returns their ids [N]
+        """
+        ll = np.asarray(points, dtype=float).reshape(len(points), -1)
+        n = len(ll)
+        ids = np.arange(self.next, self.next + n)
+        if n == 0:
+            return ids
+
+        self._grow(n)
+        new = slice(self.next, self.next + n)
+        self.ll[new] = ll[:,:2]
+        self.unit[new] = _unit(ll)
+        self.alive[new] = True
+        self.next += n
+        self.size += n
+        self.pending.extend(ids.tolist())
+        return ids
+
+    def remove(self, id):
+        """Removes a waypoint by id"""
+        if id not in self:
+            raise KeyError(id)
+        self.alive[id] = False
+        self.size -= 1
+        if id in self.pending:
+            self.pending.remove(id)
+        else:
+            self.dead += 1
+
+    def _build(self):
+        ids = np.flatnonzero(self.alive[:self.next])
+        pts = self.unit[ids]
+        order = np.arange(len(ids))
+        nodes = []
+
+        def split(start, stop):
+            p = pts[order[start:stop]]
+            lo, hi = p.min(axis=0), p.max(axis=0)
+            node = len(nodes)
+            nodes.append(None)
+            if stop - start <= self.leaf:
+                nodes[node] = (start, stop, tuple(lo.tolist()), tuple(hi.tolist()), -1, -1)
+                return node
+
+            # halve along the widest side of the box
+            dim = int(np.argmax(hi - lo))
+            mid = (start + stop)//2
+            sub = order[start:stop]
+            order[start:stop] = sub[np.argpartition(p[:,dim], mid - start)]
+            left = split(start, mid)
+            right = split(mid, stop)
+            nodes[node] = (start, stop, tuple(lo.tolist()), tuple(hi.tolist()), left, right)
+            return node
+
+        if len(ids):
+            split(0, len(ids))
+        self.nodes = nodes
+        self.tree_ids = ids[order]
+        self.tree_pts = pts[order]
+        self.pending = []
+        self.dead = 0
+
+    def _refresh(self):
+        tree = len(self.tree_ids)
+        if len(self.pending) > 64 + tree//8 or self.dead > tree//2:
+            self._build()
+
+    def _query(self, point):
+        ll = np.asarray(point, dtype=float)[:2]
+        lat, lon = radians(ll[0]), radians(ll[1])
+        q = (cos(lat)*cos(lon), cos(lat)*sin(lon), sin(lat))
+        self._refresh()
+        self.visited = 0
+        return ll, q
+
+    def _leaf(self, q, start, stop):
+        """ids [n] and squared chord distances [n] of a leaf's live points"""
+        self.visited += 1
+        ids = self.tree_ids[start:stop]
+        d = self.tree_pts[start:stop] - q
+        d2 = np.einsum("ij,ij->i", d, d)
+        keep = self.alive[ids]
+        return ids[keep], d2[keep]
+
+    def _pending(self, q):
+        ids = np.array(self.pending, dtype=int)
+        d = self.unit[ids] - q
+        return ids, np.einsum("ij,ij->i", d, d)
+
+    def within(self, point, radius):
+        """
+        Waypoints within radius of a point
+
+        point: (lat, lon) in deg
+        radius: haversine distance [m]
+        returns: ids [n], distances [n] in meters, nearest first
+        """
+        ll, q = self._query(point)
+
+        # chord on the unit sphere for the radius, a little bigger so
+        # rounding doesn't drop a point that is right on it
+        a = min(radius/self.wgs.r, pi)
+        c2 = (2*sin(a/2))**2*(1 + 1e-9) + 1e-18
+
+        if a == pi:
+            # all of the world
+            ids = np.flatnonzero(self.alive[:self.next])
+        else:
+            parts = [np.array(self.pending, dtype=int)]
+            stack = [0] if self.nodes else []
+            while stack:
+                start, stop, lo, hi, left, right = self.nodes[stack.pop()]
+                if _box_near(q, lo, hi) > c2:
+                    continue
+                if left < 0 or _box_far(q, lo, hi) <= c2:
+                    # a leaf, or the whole box is inside the radius
+                    self.visited += 1
+                    i = self.tree_ids[start:stop]
+                    parts.append(i[self.alive[i]])
+                else:
+                    stack.append(left)
+                    stack.append(right)
+            ids = np.concatenate(parts)
+
+        dist = self.wgs.haversine(ll, self.ll[ids])
+        keep = dist <= radius
+        ids, dist = ids[keep], dist[keep]
+        order = np.argsort(dist, kind="stable")
+        return ids[order], dist[order]
+
+    def nearest(self, point, k=1):
+        """
+        The k nearest waypoints to a point
+
+        point: (lat, lon) in deg
+        k: number of waypoints, fewer are returned if there aren't k
+        returns: ids [k], distances [k] in meters, nearest first
+        """
+        ll, q = self._query(point)
+        k = min(k, self.size)
+
+        # best k so far, leaves are visited closest box first and the
+        # search stops once no box can hold anything closer
+        ids, d2 = self._pending(q)
+        heap = [(_box_near(q, *self.nodes[0][2:4]), 0)] if self.nodes else []
+        while True:
+            if len(ids) > k:
+                keep = np.argpartition(d2, k - 1)[:k] if k else []
+                ids, d2 = ids[keep], d2[keep]
+            kth = d2.max() if len(ids) == k and k else np.inf
+            if not heap or heap[0][0] > kth:
+                break
+
+            # down to the closest leaf, queueing the other sides
+            n = heappop(heap)[1]
+            start, stop, lo, hi, left, right = self.nodes[n]
+            while left >= 0:
+                l, r = self.nodes[left], self.nodes[right]
+                dl, dr = _box_near(q, *l[2:4]), _box_near(q, *r[2:4])
+                if dl > dr:
+                    left, right, l, r, dl, dr = right, left, r, l, dr, dl
+                heappush(heap, (dr, right))
+                start, stop, lo, hi, left, right = l
+            i, d = self._leaf(q, start, stop)
+            ids = np.concatenate((ids, i))
+            d2 = np.concatenate((d2, d))
+
+        dist = self.wgs.haversine(ll, self.ll[ids])
+        order = np.argsort(dist, kind="stable")
+        return ids[order], dist[order]
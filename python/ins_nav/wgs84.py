@@ -10,11 +10,140 @@ from numpy.linalg import norm
 from numpy import cos, pi, sqrt
 from numpy import sin, arcsin as asin
 from numpy import arctan2, arctan as atan, tan
+from ins_nav.backend import jitable, kernel
+from ins_nav.offsets import ECEFOffsets
 
 
 deg2rad = np.pi/180
 rad2deg = 180/np.pi
 
+
+@jitable
+def zhu(x, y, z, a, a2, b2, e2, er2):
+    """
+    Zhu's closed form ECEF to geodetic conversion, works on scalars or
+    arrays of points
+
+    x,y,z: ECEF [m]
+    a: semi-major axis [m]
+    a2, b2: semi-major and semi-minor axis squared [m^2]
+    e2: first eccentricity squared
+    er2: second eccentricity squared
+
+    returns: lat [deg], lon [deg], h [m]
+
+    https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#From_ECEF_to_geodetic_coordinates
+    """
+    z2 = z**2
+
+    p2 = x**2 + y**2
+    p = sqrt(p2)
+
+    F = 54 * b2 * z2
+    G = p2 + (1-e2)*z2 - e2*(a2-b2)
+    c = (e2**2 * F * p2) / G**3
+    s = (1+c+sqrt(c**2 + 2*c))**(1/3)
+    k = s+1+1/s
+    P = F / (3 * k**2 * G**2)
+    Q = sqrt(1+ 2* e2**2 * P)
+    ro = -(P * e2 * p) / (1 + Q) + sqrt(0.5*a2 * (1+1/Q) - P*(1-e2)*z2 / (Q+Q**2) - 0.5 * P *p2)
+    U = sqrt((p-e2*ro)**2 + z2)
+    V = sqrt((p-e2*ro)**2 + (1-e2) * z2)
+    zo = b2*z / (a*V)
+    h = U * (1 - b2 / (a*V))
+    lat = arctan2(z+er2*zo, p) * (180/pi)
+    lon = arctan2(y, x) * (180/pi)
+
+    return lat, lon, h
+
+
+@jitable
+def bowring(x, y, z, a, b, e2, er2):
+    """
+    Bowring's method with one iteration, good to well under a millimeter
+    for anything near the surface of the Earth
+
+    x,y,z: ECEF [m]
+    a: semi-major axis [m]
+    b: semi-minor axis [m]
+    e2: first eccentricity squared
+    er2: second eccentricity squared
+
+    returns: lat [deg], lon [deg], h [m]
+
+    ref: Bowring, Transformation from spatial to geographical coordinates,
+        Survey Review, 1976
+    """
+    p = sqrt(x**2 + y**2)
+
+    # sin/cos of the parametric latitude without any trig
+    za = z*a
+    pb = p*b
+    r = sqrt(za**2 + pb**2)
+    st = za/r
+    ct = pb/r
+
+    num = z + er2*b*st**3
+    den = p - e2*a*ct**3
+    r = sqrt(num**2 + den**2)
+    sl = num/r
+    h = p*(den/r) + z*sl - a*sqrt(1 - e2*sl**2)
+    return arctan2(num, den)*(180/pi), arctan2(y, x)*(180/pi), h
+
+
+def iterative(x, y, z, a, e2, tol, max_iter):
+    """
+    Fixed point iteration on the latitude, started from Bowring's
+    estimate and stopped when every latitude changes less than tol
+
+    x,y,z: ECEF [m]
+    a: semi-major axis [m]
+    e2: first eccentricity squared
+    tol: latitude tolerance [rad]
+    max_iter: max iterations
+
+    returns: lat [deg], lon [deg], h [m]
+    """
+    b = a*sqrt(1 - e2)
+    lat, lon, _ = bowring(x, y, z, a, b, e2, e2/(1 - e2))
+    lat = lat*deg2rad
+    p = sqrt(x**2 + y**2)
+
+    for _ in range(max_iter):
+        sl = sin(lat)
+        w = sqrt(1 - e2*sl**2)
+        N = a/w
+        h = p*cos(lat) + z*sl - a*w
+        new = arctan2(z, p*(1 - e2*N/(N + h)))
+        done = np.all(np.abs(new - lat) <= tol)
+        lat = new
+        if done:
+            break
+
+    sl = sin(lat)
+    h = p*cos(lat) + z*sl - a*sqrt(1 - e2*sl**2)
+    return lat*rad2deg, lon, h
+
+
+def _columns(a, sizes):
+    """
+    True if a is [k,N] (one coordinate per row) rather than [N,k] or [k],
+    k being one of sizes. [N,k] wins whenever the last axis fits, so with
+    sizes (2,3) a [3,3] or [2,3] is read as points of 3 and a [3,2] or
+    [2,2] as points of 2, never as columns.
+    """
+    if a.ndim == 1:
+        if a.shape[0] not in sizes:
+            raise ValueError(f"expected a point of size {sizes}, got {a.shape}")
+        return False
+    if a.ndim == 2:
+        if a.shape[1] in sizes:
+            return False
+        if a.shape[0] in sizes:
+            return True
+    raise ValueError(f"expected [N,k] or [k,N] with k in {sizes}, got {a.shape}")
+
+
 class WGS84:
     """
     WGS84 is used in GPS which are geodetic coordinates.
@@ -47,12 +176,25 @@ class WGS84:
         self.a = 6378137.0
         self.b = self.a - self.a * self.f
         self.e = np.sqrt(1 - (self.b ** 2 / self.a ** 2))
+
+        # derived constants used by the conversions
+        self.a2 = self.a**2
+        self.b2 = self.b**2
+        self.e2 = 1 - self.b2/self.a2          # first eccentricity squared
+        self.er2 = (self.a2 - self.b2)/self.b2 # second eccentricity squared
         self.r = (2*self.a + self.b) / 3
         self.rotation_period = 23*3600 + 56*60 + 4.09053
 
         self.rate = 7.2921157e-5  # Rotation rate of Earth [rad/s]
         self.sf = 1.2383e-3       # Schuller frequency
 
+        # WGS84 normal gravity (Somigliana), NIMA TR8350.2 chapter 4
+        self.GM = 3.986004418e14  # gravitational parameter [m^3/sec^2]
+        self.ge = 9.7803253359    # normal gravity at the equator [m/sec^2]
+        self.gp = 9.8321849378    # normal gravity at the poles [m/sec^2]
+        self.gk = 0.00193185265241  # b*gp/(a*ge) - 1
+        self.gm = 0.00344978650684  # w^2 a^2 b/GM
+
     def gravity(self, lat):
         """
         Based off the Oxford reference for the gravity formula at sealevel.
@@ -62,115 +204,454 @@ class WGS84:
         intensive and only differs from this one by 0.68 um/s^2
         https://en.wikipedia.org/wiki/Gravity_of_Earth
 
-        lat: latitude [decimal deg], North is positive and South is negative
+        lat: latitude [decimal deg], North is positive and South is negative,
+            scalar or array
         """
-        lat = lat*deg2rad
+        lat = np.asarray(lat)*deg2rad
         G0 = 9.7803253359              # Gravity [m/sec^2]
         return G0*(1 + 0.0053024*sin(lat)**2 - 0.0000058*sin(2*lat)**2)
 
+    def normal_gravity_coef(self, lat):
+        """
+        Normal gravity is g0*(1 - c1*h + c2*h^2), returns g0 [m/sec^2] and
+        c1 [1/m] for lat [deg]. c2 = 3/a^2 doesn't depend on latitude.
+        """
+        s2 = sin(np.asarray(lat)*deg2rad)**2
+        g0 = self.ge*(1 + self.gk*s2) / sqrt(1 - self.e2*s2)
+        c1 = 2/self.a*(1 + self.f + self.gm - 2*self.f*s2)
+        return g0, c1
+
+    def normal_gravity(self, lat, h=0.0):
+        """
+        WGS84 normal gravity with the height correction, good for the
+        heights aircraft fly at. Use GravityTable for a cheaper lookup.
+        https://en.wikipedia.org/wiki/Theoretical_gravity
+
+        lat: latitude [deg], scalar or array
+        h: height above the ellipsoid [m], scalar or array
+        returns: gravity [m/sec^2]
+        """
+        g0, c1 = self.normal_gravity_coef(lat)
+        h = np.asarray(h)
+        return g0*(1 - c1*h + 3/self.a2*h*h)
+
+    def gravity_table(self, step=None, tol=1e-7):
+        """Returns a GravityTable for this ellipsoid, see GravityTable"""
+        return GravityTable(self, step, tol)
+
     def haversine(self, a, b):
         """
         Returns the haversine (or great circle) distance between
         2 sets of GPS coordinates. This appears to work really well.
 
-        a: (lat, lon) in deg
-        b: (lat, lon) in deg
+        a: (lat, lon) in deg, or [N,2]
+        b: (lat, lon) in deg, or [N,2]
+
+        One point to one point gives a single distance [m], one point to
+        [N,2] gives the N distances from that point and two [N,2] give
+        the N element-wise distances. Extra columns (height) are ignored.
         """
-        lat = b[0]*deg2rad
+        a = np.asarray(a, dtype=float).T
+        b = np.asarray(b, dtype=float).T
         # R = 6371008.8
         R = self.r
         dlat = (b[0] - a[0])*deg2rad
         dlon = (b[1] - a[1])*deg2rad
         m = sin(dlat*0.5)**2 + cos(a[0]*deg2rad) * cos(b[0]*deg2rad) * sin(dlon*0.5)**2
-        return R*2*asin(min(1, sqrt(m)))
+        return R*2*asin(np.minimum(1, sqrt(m)))
+
+    def haversine_blocks(self, a, b, rows=None, max_bytes=1<<26):
+        """
+        Pairwise haversine distances between every point in a and every
+        point in b, streamed as blocks of rows so the whole [M,N] matrix
+        never has to be in memory.
+
+        for i, d in wgs.haversine_blocks(waypoints, fixes):
+            nearest[i:i+len(d)] = d.argmin(axis=1)
+
+        Each block is worked out in place with two scratch [rows,N]
+        arrays that are reused, so memory peaks at 3 [rows,N] float64
+        arrays (24*rows*N bytes) plus any earlier blocks the caller keeps.
+
+        a: [M,2] (lat, lon) in deg
+        b: [N,2] (lat, lon) in deg
+        rows: number of rows of a in each block, None picks the most that
+            fit in max_bytes
+        max_bytes: memory budget for a block when rows is None
+        yields: (i, d) where d [rows,N] are the distances [m] from
+            a[i:i+rows] to all of b
+        """
+        a = np.asarray(a, dtype=float)
+        b = np.asarray(b, dtype=float)
+        N = len(b)
+        if rows is None:
+            rows = max(1, max_bytes//(24*max(N, 1)))
+
+        # the trig of each point is only done once, a block is then just
+        # products using sin((x-y)/2) = sin(x/2)cos(y/2) - cos(x/2)sin(y/2)
+        def half(p):
+            lat = p[:,0]*deg2rad
+            lon = p[:,1]*deg2rad
+            return (sin(lat*0.5), cos(lat*0.5), cos(lat),
+                    sin(lon*0.5), cos(lon*0.5))
+
+        slat_a, clat_a, cos_a, slon_a, clon_a = (x[:,None] for x in half(a))
+        slat_b, clat_b, cos_b, slon_b, clon_b = half(b)
+        R2 = 2*self.r
+        rows = max(1, min(rows, len(a)))
+        s = np.empty((rows, N))
+        t = np.empty((rows, N))
+
+        for i in range(0, len(a), rows):
+            j = slice(i, i+rows)
+            m = np.empty((len(clat_a[j]), N))
+            s_, t_ = s[:len(m)], t[:len(m)]
+
+            # sin(dlat/2)^2
+            np.multiply(clat_a[j], slat_b, out=m)
+            np.multiply(slat_a[j], clat_b, out=t_)
+            m -= t_
+            m *= m
+
+            # cos(lat_a) cos(lat_b) sin(dlon/2)^2
+            np.multiply(clon_a[j], slon_b, out=s_)
+            np.multiply(slon_a[j], clon_b, out=t_)
+            s_ -= t_
+            s_ *= s_
+            np.multiply(cos_a[j], cos_b, out=t_)
+            s_ *= t_
+            m += s_
+
+            np.sqrt(m, out=m)
+            np.minimum(m, 1, out=m)
+            np.arcsin(m, out=m)
+            m *= R2
+            yield i, m
+            del m  # so it can be freed before the next block
+
+    def geodesic_inverse(self, a, b, tol=1e-12, max_iter=200):
+        """
+        Distance and azimuths between points on the ellipsoid using
+        Vincenty's inverse method, accurate to about a millimeter unlike
+        haversine which can be off by 0.5%. Each pair stops iterating once
+        it has converged, so a few slow pairs only cost for themselves.
+
+        a: (lat, lon) in deg, or [N,2]
+        b: (lat, lon) in deg, or [N,2]
+        tol: convergence of the longitude on the auxiliary sphere [rad]
+        max_iter: pairs that haven't converged by then (nearly antipodal
+            points) are returned as nan
+        returns: distance [m], azimuth at a [deg], azimuth at b [deg],
+            azimuths are clockwise from north in (-180, 180]
+
+        https://en.wikipedia.org/wiki/Vincenty%27s_formulae
+        """
+        a = np.asarray(a, dtype=float).T
+        b = np.asarray(b, dtype=float).T
+        lat1, lon1, lat2, lon2 = np.broadcast_arrays(a[0], a[1], b[0], b[1])
+        shape = lat1.shape
+        f = self.f
+
+        L = ((lon2 - lon1).ravel() + 180) % 360 - 180
+        L *= deg2rad
+        # reduced latitudes, tan(U) = (1-f)tan(lat)
+        tU1 = (1-f)*tan(lat1.ravel()*deg2rad)
+        tU2 = (1-f)*tan(lat2.ravel()*deg2rad)
+        cU1 = 1/sqrt(1 + tU1*tU1)
+        cU2 = 1/sqrt(1 + tU2*tU2)
+        sU1 = tU1*cU1
+        sU2 = tU2*cU2
+
+        def terms(lam, sU1, cU1, sU2, cU2):
+            sl, cl = sin(lam), cos(lam)
+            x = cU2*sl
+            y = cU1*sU2 - sU1*cU2*cl
+            ssig = sqrt(x*x + y*y)
+            csig = sU1*sU2 + cU1*cU2*cl
+            sig = arctan2(ssig, csig)
+            salp = cU1*cU2*sl / np.where(ssig == 0, 1, ssig)
+            c2alp = 1 - salp*salp
+            c2sm = csig - 2*sU1*sU2 / np.where(c2alp == 0, 1, c2alp)
+            c2sm = np.where(c2alp == 0, 0, c2sm)  # equatorial line
+            return ssig, csig, sig, salp, c2alp, c2sm
+
+        # iterate only the pairs that are still moving, the working set is
+        # compacted once it has halved so the gathers don't cost more than
+        # the iterations they save
+        lam = L.copy()
+        active = np.arange(len(L))
+        work = (L, sU1, cU1, sU2, cU2)
+        wlam = lam
+        moving = np.ones(len(L), dtype=bool)
+        for _ in range(max_iter):
+            ssig, csig, sig, salp, c2alp, c2sm = terms(wlam, *work[1:])
+            C = f/16*c2alp*(4 + f*(4 - 3*c2alp))
+            new = work[0] + (1-C)*f*salp*(sig + C*ssig*(c2sm + C*csig*(-1 + 2*c2sm**2)))
+            moving &= np.abs(new - wlam) > tol
+            # converged pairs are left where they are
+            wlam = np.where(moving, new, wlam)
+            n = np.count_nonzero(moving)
+            if n == 0:
+                break
+            if 2*n < len(moving):
+                lam[active] = wlam
+                active = active[moving]
+                work = tuple(x[moving] for x in work)
+                wlam = wlam[moving]
+                moving = np.ones(n, dtype=bool)
+        lam[active] = wlam
+        active = active[moving]
+
+        ssig, csig, sig, salp, c2alp, c2sm = terms(lam, sU1, cU1, sU2, cU2)
+        u2 = c2alp*self.er2
+        A = 1 + u2/16384*(4096 + u2*(-768 + u2*(320 - 175*u2)))
+        B = u2/1024*(256 + u2*(-128 + u2*(74 - 47*u2)))
+        dsig = B*ssig*(c2sm + B/4*(csig*(-1 + 2*c2sm**2)
+            - B/6*c2sm*(-3 + 4*ssig**2)*(-3 + 4*c2sm**2)))
+        dist = self.b*A*(sig - dsig)
+
+        sl, cl = sin(lam), cos(lam)
+        az1 = arctan2(cU2*sl, cU1*sU2 - sU1*cU2*cl)*rad2deg
+        az2 = arctan2(cU1*sl, -sU1*cU2 + cU1*sU2*cl)*rad2deg
+
+        dist[active] = np.nan
+        az1[active] = np.nan
+        az2[active] = np.nan
+        return dist.reshape(shape), az1.reshape(shape), az2.reshape(shape)
+
+    def geodesic_direct(self, a, az, dist, tol=1e-12, max_iter=200):
+        """
+        Destination on the ellipsoid after traveling dist along a geodesic
+        starting at a with azimuth az, using Vincenty's direct method.
+
+        a: (lat, lon) in deg, or [N,2]
+        az: starting azimuth [deg] clockwise from north, scalar or [N]
+        dist: distance to travel [m], scalar or [N]
+        tol: convergence of the angular distance on the auxiliary sphere [rad]
+        max_iter: max iterations
+        returns: destination (lat, lon) in deg [2] or [N,2], azimuth at the
+            destination [deg]
+
+        https://en.wikipedia.org/wiki/Vincenty%27s_formulae
+        """
+        a = np.asarray(a, dtype=float).T
+        lat1, lon1, az, dist = np.broadcast_arrays(a[0], a[1], az, dist)
+        shape = lat1.shape
+        f = self.f
+
+        alp1 = az.ravel()*deg2rad
+        s = dist.ravel().astype(float)
+        sa1, ca1 = sin(alp1), cos(alp1)
+        tU1 = (1-f)*tan(lat1.ravel()*deg2rad)
+        cU1 = 1/sqrt(1 + tU1*tU1)
+        sU1 = tU1*cU1
+        sig1 = arctan2(tU1, ca1)
+        salp = cU1*sa1
+        c2alp = 1 - salp*salp
+        u2 = c2alp*self.er2
+        A = 1 + u2/16384*(4096 + u2*(-768 + u2*(320 - 175*u2)))
+        B = u2/1024*(256 + u2*(-128 + u2*(74 - 47*u2)))
+
+        def terms(sig, i):
+            c2sm = cos(2*sig1[i] + sig)
+            ssig, csig = sin(sig), cos(sig)
+            dsig = B[i]*ssig*(c2sm + B[i]/4*(csig*(-1 + 2*c2sm**2)
+                - B[i]/6*c2sm*(-3 + 4*ssig**2)*(-3 + 4*c2sm**2)))
+            return c2sm, ssig, csig, dsig
+
+        s0 = s/(self.b*A)
+        sig = s0.copy()
+        active = np.arange(len(s))
+        for _ in range(max_iter):
+            c2sm, ssig, csig, dsig = terms(sig[active], active)
+            new = s0[active] + dsig
+            moving = np.abs(new - sig[active]) > tol
+            sig[active] = new
+            active = active[moving]
+            if len(active) == 0:
+                break
+
+        c2sm, ssig, csig, _ = terms(sig, slice(None))
+        x = sU1*ssig - cU1*csig*ca1
+        lat2 = arctan2(sU1*csig + cU1*ssig*ca1, (1-f)*sqrt(salp*salp + x*x))
+        lam = arctan2(ssig*sa1, cU1*csig - sU1*ssig*ca1)
+        C = f/16*c2alp*(4 + f*(4 - 3*c2alp))
+        L = lam - (1-C)*f*salp*(sig + C*ssig*(c2sm + C*csig*(-1 + 2*c2sm**2)))
+        lon2 = (lon1.ravel() + L*rad2deg + 180) % 360 - 180
+        az2 = arctan2(salp, -x)*rad2deg
+
+        pt = np.stack((lat2*rad2deg, lon2), axis=-1)
+        return pt.reshape(shape + (2,)), az2.reshape(shape)
 
     def radius(self, lat):
         """
         Returns the geocentric radius based on WGS84
 
-        lat: latitude in deg
+        lat: latitude in deg, scalar or array
         """
-        a = self.a
-        b = self.b
-        lat = lat*deg2rad
-        num = (a**2 * cos(lat))**2 + (b**2 * sin(lat))**2
-        den = (a * cos(lat))**2 + (b * sin(lat))**2
+        lat = np.asarray(lat)*deg2rad
+        c2 = cos(lat)**2
+        s2 = 1 - c2
+        num = self.a2**2 * c2 + self.b2**2 * s2
+        den = self.a2 * c2 + self.b2 * s2
         return sqrt(num / den)
 
-    # def llh2ecef(self, lla):
-    #     """
-    #     llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
-    #     ecef: Earth Centered Earth Fixed in [m, m, m]
-
-    #     ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion
-    #     """
-    #     lat = lla[0] *deg2rad
-    #     lon = lla[1] * deg2rad
-
-    #     if len(lla) == 2:
-    #         H = 0
-    #     else:
-    #         H = lla[2]
-
-    #     e2 = self.e**2
-    #     n = self.a / sqrt(1.0 - e2 * sin(lat)**2)
-
-    #     x = (n + H) * cos(lat) * cos(lon)
-    #     y = (n + H) * cos(lat) * sin(lon)
-    #     z = ((1 - e2) * n + H) * sin(lat)
-    #     return np.array([x, y, z])
-
-    def llh2ecef(self, lat, lon, H):
-        # matlab: https://www.mathworks.com/help/aeroblks/llatoecefposition.html
-        # this works, matches: https://www.oc.nps.edu/oc2902w/coord/llhxyz.htm
-        mu = lat*pi/180
-        i = lon*pi/180
-        r = 6378137
-        f = 1/298.257223563
-        ls = atan((1-f)**2 * tan(mu))
-        rs = sqrt(r**2 / (1+ (1/(1-f)**2 - 1)*sin(ls)**2))
-
-        x = rs*cos(ls)*cos(i) + H*cos(mu)*cos(i)
-        y = rs*cos(ls)*sin(i) + H*cos(mu)*sin(i)
-        z = rs*sin(ls)+H*sin(mu)
+    def llh2ecef(self, lat, lon=None, H=None):
+        """
+        llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
+        ecef: Earth Centered Earth Fixed in [m, m, m]
+
+        Either llh2ecef(lat, lon, H=0) which returns a tuple (x,y,z), or
+        llh2ecef(llh) where llh is [3], [N,3] or [3,N] (height can be left
+        off, [2], [N,2] or [2,N]) which returns ecef as [3], [N,3] or [3,N].
+        Rows are tried first, so [3,3] and [2,3] are (lat, lon, H) points and
+        [3,2] and [2,2] are (lat, lon) points, pass [N,k] for 2 or 3 points.
+
+        ref: https://en.wikipedia.org/wiki/Geographic_coordinate_conversion
+        matches: https://www.oc.nps.edu/oc2902w/coord/llhxyz.htm
+        """
+        packed = lon is None
+        if packed:
+            llh = np.asarray(lat, dtype=float)
+            columns = _columns(llh, (2, 3))
+            if not columns:
+                llh = llh.T
+            lat, lon = llh[:2]
+            H = llh[2] if len(llh) > 2 else 0.0
+        elif H is None:
+            H = 0.0
+
+        lat = lat*deg2rad
+        lon = lon*deg2rad
+        e2 = self.e2
+
+        slat = sin(lat)
+        clat = cos(lat)
+        n = self.a / sqrt(1.0 - e2*slat**2)
 
+        x = (n + H) * clat * cos(lon)
+        y = (n + H) * clat * sin(lon)
+        z = ((1 - e2) * n + H) * slat
+
+        if packed:
+            return np.stack((x, y, z), axis=0 if columns else -1)
         return x,y,z
 
-    def ecef2llh(self, ecef):
+    def ecef2llh(self, ecef, method="zhu", tol=1e-12, max_iter=10):
         """
         llh: latitude (phi), longitude(lambda), height (or altitude) (H) in [deg, deg, m]
         ecef: Earth Centered Earth Fixed in [m, m, m]
 
+        ecef: [3], [N,3] or [3,N] (a [3,3] is taken as [N,3]), or
+            ECEFOffsets
+        method: "zhu" closed form (default, nan right at the poles),
+            "bowring" one iteration which is the cheapest and good to 0.1mm
+            up to 100km, or "iterative" which repeats until the latitude
+            changes less than tol [rad], for post processing
+        returns: llh in the same shape as ecef, [N,3] for ECEFOffsets
+        raises: ValueError for a point at (0,0,0)
+
         https://en.wikipedia.org/wiki/Geographic_coordinate_conversion#From_ECEF_to_geodetic_coordinates
         """
-        x,y,z = ecef
-
-        a = self.a
-        a2 = self.a**2
-        b2 = self.b**2
-        e2 = self.e**2
-        er2 = (a**2 - b2) / b2
-        z2 = z**2
-
-        p2 = x**2 + y**2
-        p = sqrt(p2)
-
-        F = 54 * b2 * z2
-        G = p2 + (1-e2)*z2 - e2*(a2-b2)
-        c = (e2**2 * F * p2) / G**3
-        s = pow(1+c+sqrt(c**2 + 2*c), 1/3)
-        k = s+1+1/s
-        P = F / (3 * k**2 * G**2)
-        Q = sqrt(1+ 2* e2**2 * P)
-        ro = -(P * e2 * p) / (1 + Q) + sqrt(0.5*a2 * (1+1/Q) - P*(1-e2)*z2 / (Q+Q**2) - 0.5 * P *p2)
-        U = sqrt((p-e2*ro)**2 + z2)
-        V = sqrt((p-e2*ro)**2 + (1-e2) * z2)
-        zo = b2*z / (a*V)
-        h = U * (1 - b2 / (a*V))
-        lat = arctan2(z+er2*zo, p) *rad2deg
-        lon = arctan2(y, x) * rad2deg
-
-        return np.array([lat, lon, h])
+        columns = False
+        if isinstance(ecef, ECEFOffsets):
+            x, y, z = ecef.columns()
+        else:
+            ecef = np.asarray(ecef, dtype=float)
+            columns = _columns(ecef, (3,))
+            x, y, z = ecef if columns else ecef.T
+
+        # the kernels would give nan with numpy but raise with numba here
+        if np.any((x == 0) & (y == 0) & (z == 0)):
+            raise ValueError("the center of the Earth has no latitude or height")
+
+        if method == "zhu":
+            lat, lon, h = kernel(zhu)(x, y, z, self.a, self.a2, self.b2, self.e2, self.er2)
+        elif method == "bowring":
+            lat, lon, h = kernel(bowring)(x, y, z, self.a, self.b, self.e2, self.er2)
+        elif method == "iterative":
+            lat, lon, h = iterative(x, y, z, self.a, self.e2, tol, max_iter)
+        else:
+            raise ValueError(f"unknown ecef2llh method: {method}")
+
+        return np.stack((lat, lon, h), axis=0 if columns else -1)
+
+
+
+class GravityTable:
+    """
+    Precomputed WGS84 normal gravity for high rate INS loops. The latitude
+    terms are tabulated and linearly interpolated, the height correction
+    is a quadratic so it is done exactly. Gives the same answer as
+    WGS84.normal_gravity() to within error.
+
+    table = WGS84().gravity_table(tol=1e-8)
+    g = table(lat, h)  # scalars or arrays
+
+    wgs: WGS84 to take the model from
+    step: table resolution [deg], None picks the largest step that meets tol
+    tol: max interpolation error [m/sec^2] when step is None
+    error: max interpolation error [m/sec^2] of the table, found by
+        checking the exact model half way between every table entry
+    """
+    def __init__(self, wgs=None, step=None, tol=1e-7):
+        wgs = WGS84() if wgs is None else wgs
+        self.c2 = 3/wgs.a2
+
+        if step is None:
+            step = 1.0
+            while self._build(wgs, step) > tol and step > 1e-4:
+                step /= 2
+        else:
+            self._build(wgs, step)
+
+    def _build(self, wgs, step):
+        n = int(np.ceil(180/step)) + 1
+        lat = np.linspace(-90, 90, n)
+        self.step = 180/(n-1)
+        self.scale = 1/self.step
+
+        # store the value and slope in each cell, g0 and g0*c1
+        g0, c1 = wgs.normal_gravity_coef(lat)
+        self.g = g0
+        self.dg = np.diff(g0, append=g0[-1])
+        self.gc = g0*c1
+        self.dgc = np.diff(self.gc, append=self.gc[-1])
+        self._lists = (self.g.tolist(), self.dg.tolist(), self.gc.tolist(), self.dgc.tolist())
+
+        # worst case is half way between entries, check at sea level and 20km
+        mid = lat[:-1] + self.step/2
+        self.error = 0.0
+        for h in (0.0, 20000.0):
+            err = np.abs(self(mid, h) - wgs.normal_gravity(mid, h))
+            self.error = max(self.error, float(err.max()))
+        return self.error
+
+    def __call__(self, lat, h=0.0):
+        """
+        lat: latitude [deg], scalar or array, gravity is symmetric so
+            only |lat| is used and it is clipped to 90
+        h: height above the ellipsoid [m], scalar or array
+        returns: gravity [m/sec^2], nan where lat is nan
+        """
+        if isinstance(lat, float) or isinstance(lat, int):
+            # one sample, plain floats are much faster than numpy here
+            lat = min(abs(lat), 90.0)
+            if lat != lat:
+                return float("nan")
+            x = (lat + 90)*self.scale
+            i = min(int(x), len(self.g) - 2)
+            t = x - i
+            g, dg, gc, dgc = self._lists
+            return g[i] + t*dg[i] - (gc[i] + t*dgc[i])*h + (g[i] + t*dg[i])*self.c2*h*h
+
+        x = (np.minimum(np.abs(np.asarray(lat, dtype=float)), 90) + 90)*self.scale
+        # a nan latitude gets entry 0, t is nan so the answer is too
+        i = np.minimum(np.where(x == x, x, 0).astype(int), len(self.g) - 2)
+        t = x - i
+        g0 = self.g[i] + t*self.dg[i]
+        h = np.asarray(h)
+        return g0*(1 + self.c2*h*h) - (self.gc[i] + t*self.dgc[i])*h
 
 
 
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def imu_data():
+    """
+    Factory for fake accel/gyro/mag logs of a slowly tumbling sensor,
+    imu_data(N, seed) returns a, g, m [N,3] and dt [N]
+    """
+    def make(N=500, seed=1):
+        rng = np.random.default_rng(seed)
+        a = np.array([0,0,1.]) + 0.05*rng.standard_normal((N,3))
+        g = 0.2*rng.standard_normal((N,3))
+        m = np.array([20,-5,-40.]) + 0.5*rng.standard_normal((N,3))
+        dt = 0.01 + 0.001*rng.random(N)
+        return a, g, m, dt
+    return make
@@ -0,0 +1,66 @@
+from ins_nav.acquire import Acquisition
+import asyncio
+import time
+import pytest
+
+
+def test_acquisition():
+    def slow_baro():
+        time.sleep(0.05)  # blocking I2C read
+        return 1013.25
+
+    async def mag():
+        return (1.,2.,3.)
+
+    samples = {"mag": [], "baro": [], "imu": []}
+    def handler(name, ts, value):
+        samples[name].append(ts)
+
+    acq = Acquisition()
+    acq.add("mag", mag, 200)
+    acq.add("baro", slow_baro, 100)
+    acq.add("imu", lambda: (0,0,1), 100, blocking=False)
+    counts = asyncio.run(acq.run(handler, duration=0.5))
+
+    assert counts == {k: len(v) for k, v in samples.items()}
+    # the slow barometer doesn't hold back the faster sensors
+    assert counts["mag"] > 60
+    assert counts["imu"] > 30
+    assert counts["baro"] < 15
+    for ts in samples.values():
+        assert all(a < b for a, b in zip(ts, ts[1:]))
+
+def test_acquisition_stop():
+    acq = Acquisition()
+
+    async def handler(name, ts, value):
+        if value > 4:
+            acq.stop()
+
+    cnt = iter(range(1000))
+    acq.add("count", lambda: next(cnt), 100, blocking=False)
+    counts = asyncio.run(acq.run(handler))
+    assert 5 <= counts["count"] <= 7
+
+def test_acquisition_error():
+    def broken():
+        raise OSError("i2c")
+
+    acq = Acquisition()
+    acq.add("broken", broken, 100)
+    with pytest.raises(OSError):
+        asyncio.run(acq.run(lambda *x: None, duration=5))
+
+def test_acquisition_handler_error():
+    # pollers blocked on a full queue when the handler fails still stop
+    async def handler(name, ts, value):
+        await asyncio.sleep(0.1)
+        raise ValueError("bad sample")
+
+    acq = Acquisition(maxsize=2)
+    acq.add("imu", lambda: (0,0,1), 1000, blocking=False)
+
+    start = time.monotonic()
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(acq.run(handler, duration=2), 5))
+    assert time.monotonic() - start < 1
@@ -15,6 +15,124 @@
 
 import pytest
 from ins_nav import *
+import numpy as np
+from math import sqrt, pi
+from ins_nav.filters.ahrs import IMUFilter
 
 def test_dummy():
     assert True
+
+
+def test_madgwick_run(imu_data):
+    a, g, m, dt = imu_data()
+
+    f = Madgwick(0.1, 0.01)
+    f.bias = np.array([1.,-2.,3.])
+    q = []
+    wb = []
+    for i in range(len(a)):
+        q.append(tuple(f.update(a[i],g[i],m[i],dt[i])))
+        wb.append(f.wb)
+
+    ff = Madgwick(0.1, 0.01)
+    ff.bias = np.array([1.,-2.,3.])
+    qq, wwb = ff.run(a, g, m, dt)
+
+    assert qq.shape == (len(a),4)
+    assert wwb.shape == (len(a),3)
+    assert np.allclose(qq, q)
+    assert np.allclose(wwb, wb)
+    assert np.allclose(tuple(ff.q), tuple(f.q))
+
+    # scalar dt and continuing from the current state
+    qq, _ = ff.run(a[:10], g[:10], m[:10], 0.01)
+    for i in range(10):
+        q = f.update(a[i],g[i],m[i],0.01)
+    assert np.allclose(qq[-1], tuple(q))
+
+def test_madgwick_fleet(imu_data):
+    B = np.array([0.1, 0.05, 0.2])
+    Z = np.array([0.01, 0.0, 0.02])
+    logs = [imu_data(100, seed) for seed in range(3)]
+
+    filters = [Madgwick(float(b), float(z)) for b, z in zip(B, Z)]
+    filters[2].bias = np.array([1.,-2.,3.])
+    fleet = MadgwickFleet(3, B, Z)
+    fleet.bias[2] = (1.,-2.,3.)
+    assert len(fleet) == 3
+
+    for i in range(100):
+        a = np.array([log[0][i] for log in logs])
+        g = np.array([log[1][i] for log in logs])
+        m = np.array([log[2][i] for log in logs])
+        dt = np.array([log[3][i] for log in logs])
+
+        qq = fleet.update(a, g, m, dt)
+        q = [tuple(f.update(a[k],g[k],m[k],dt[k])) for k, f in enumerate(filters)]
+
+    assert np.allclose(qq, q)
+    assert np.allclose(fleet.wb, [f.wb for f in filters])
+
+def test_ahrs_marg(imu_data):
+    a, g, m, dt = imu_data()
+
+    f = Madgwick(0.1, 0.01)
+    f.bias = np.array([1.,-2.,3.])
+    f.M = np.array([[1.1,0.1,0],[0.1,0.9,0],[0,0,1.05]])
+    ff = AHRS(0.1, 0.01)
+    ff.bias = (1.,-2.,3.)
+    ff.M = ((1.1,0.1,0),(0.1,0.9,0),(0,0,1.05))
+
+    for i in range(len(a)):
+        q = f.update(a[i],g[i],m[i],dt[i])
+        qq = ff.updateAGM(a[i],g[i],m[i],dt[i])
+        assert np.allclose(qq, tuple(q))
+
+    assert np.allclose(ff.wb, f.wb)
+
+def test_ahrs_imu(imu_data):
+    a, g, _, dt = imu_data()
+
+    f = IMUFilter(0.1)
+    ff = AHRS(0.1, sqrt(3/4)*f.wdr*pi/180)
+
+    for i in range(len(a)):
+        q = f.update(a[i],g[i],dt[i])
+        qq = ff.updateAG(a[i],g[i],dt[i])
+        assert np.allclose(qq, tuple(q))
+
+    assert np.allclose(ff.wb, f.wb)
+
+def test_mahony_level():
+    # a tilted filter should level itself and find the gyro bias, without
+    # a magnetometer yaw and the yaw bias are not observable
+    wb = np.array([0.01,-0.02,0.03])
+    N = 10000
+    f = Mahony(1.0, 0.3, q=(0.9,0.3,-0.2,0.1))
+    q, b = f.run(np.tile([0,0,1.],(N,1)), np.tile(wb,(N,1)), 0.01)
+
+    assert np.allclose(q[-1,1:3], 0, atol=1e-3)
+    assert np.allclose(b[-1,:2], wb[:2], atol=1e-3)
+
+    f = Mahony(1.0, 0.3, q=(0.9,0.3,-0.2,0.1))
+    q, b = f.run(
+        np.tile([0,0,1.],(N,1)), np.tile(wb,(N,1)), 0.01,
+        np.tile([20,0,-40.],(N,1)))
+
+    assert np.allclose(q[-1], (1,0,0,0), atol=1e-3)
+    assert np.allclose(b[-1], wb, atol=1e-3)
+
+def test_mahony_run(imu_data):
+    a, g, m, dt = imu_data()
+
+    for mag in (None, m):
+        f = Mahony(0.5, 0.1)
+        f.bias = (1.,-2.,3.)
+        ff = Mahony(0.5, 0.1)
+        ff.bias = (1.,-2.,3.)
+
+        qq, wb = ff.run(a, g, dt, mag)
+        for i in range(len(a)):
+            q = f.update(a[i], g[i], dt[i], None if mag is None else mag[i])
+            assert np.allclose(qq[i], q)
+            assert np.allclose(wb[i], f.wb)
@@ -0,0 +1,73 @@
+from ins_nav import *
+from ins_nav import backend
+from ins_nav.backend import kernel
+from ins_nav.filters.compass import TiltCompensatedCompass, Angle, tilt_compensate
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def numba_backend():
+    # numba is optional, if it isn't installed this compares python to python
+    yield set_backend("numba")
+    set_backend("python")
+
+def run_filters(a, g, m, dt):
+    ans = []
+
+    f = Madgwick(0.1, 0.01)
+    f.bias = np.array([1.,-2.,3.])
+    ans.extend(f.run(a, g, m, dt))
+
+    f = AHRS(0.1, 0.01)
+    ans.append([f.updateAGM(a[i],g[i],m[i],dt[i]) for i in range(100)])
+    ans.append([f.updateAG(a[i],g[i],dt[i]) for i in range(100)])
+
+    f = Mahony(0.5, 0.1)
+    ans.extend(f.run(a, g, dt))
+    ans.extend(f.run(a, g, dt, m))
+    ans.append([f.update(a[i],g[i],dt[i],m[i]) for i in range(100)])
+
+    c = TiltCompensatedCompass(Angle.radians)
+    ans.append([c.compensate(a[i],m[i]) for i in range(100)])
+
+    wgs = WGS84()
+    ans.append([wgs.ecef2llh(x) for x in [(5.057590377e6, 2.694861463e6, -2.794229000e6), (4510731, 4510731, 0)]])
+
+    return ans
+
+def test_backends_match(numba_backend, imu_data):
+    data = imu_data()
+    fast = run_filters(*data)
+    set_backend("python")
+    ref = run_filters(*data)
+
+    for x, y in zip(fast, ref):
+        assert np.allclose(x, y, rtol=1e-9, atol=1e-12)
+
+def test_backends_match_zeros(numba_backend):
+    # numpy floats divide by zero without raising, numba raises
+    zero = np.zeros(3)
+    wgs = WGS84()
+    for be in ("numba", "python"):
+        set_backend(be)
+        with pytest.raises(ZeroDivisionError):
+            kernel(tilt_compensate)(*zero, 1.0, 0.0, 0.0)
+        with pytest.raises(ZeroDivisionError):
+            kernel(tilt_compensate)(0.0, 0.0, 1.0, *zero)
+        assert TiltCompensatedCompass(Angle.radians).compensate(zero, zero) == (0.0, 0.0, 0.0)
+
+        for method in ("zhu", "bowring", "iterative"):
+            with pytest.raises(ValueError):
+                wgs.ecef2llh(zero, method=method)
+            with pytest.raises(ValueError):
+                wgs.ecef2llh([[6378137.0, 0, 0], [0, 0, 0]], method=method)
+
+def test_backend_fallback(monkeypatch):
+    monkeypatch.setattr(backend, "numba", None)
+    with pytest.warns(UserWarning):
+        assert set_backend("numba") == "python"
+    assert get_backend() == "python"
+
+    with pytest.raises(ValueError):
+        set_backend("fortran")
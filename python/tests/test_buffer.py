@@ -0,0 +1,38 @@
+from ins_nav.buffer import RingBuffer
+import numpy as np
+
+def test_ring_buffer():
+    buf = RingBuffer(5, 3)
+    assert len(buf) == 0
+    assert buf.array().shape == (0,3)
+
+    for i in range(3):
+        buf.push((i,i,i))
+    assert len(buf) == 3
+    assert not buf.full
+    assert np.array_equal(buf.array()[:,0], [0,1,2])
+
+    for i in range(3,8):
+        buf.push((i,i,i))
+    assert buf.full
+    assert np.array_equal(buf.array()[:,0], [3,4,5,6,7])
+
+    # views, not copies, and at most 2 of them
+    views = buf.latest(4)
+    assert len(views) == 2
+    assert all(v.base is buf.buffer for v in views)
+    assert np.array_equal(np.concatenate(views)[:,0], [4,5,6,7])
+    assert len(buf.latest(2)) == 1
+    assert np.array_equal(buf.array(2)[:,0], [6,7])
+
+    assert sorted(buf.data[:,0]) == [3,4,5,6,7]
+
+def test_ring_buffer_extend():
+    buf = RingBuffer(5)
+    ref = []
+    for n in (2, 3, 4, 0, 7, 1):
+        x = np.arange(len(ref), len(ref)+n)
+        buf.extend(x)
+        ref.extend(x)
+        assert np.array_equal(buf.array(), ref[-5:])
+        assert np.array_equal(buf.array(3), ref[-3:])
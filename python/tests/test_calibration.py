@@ -0,0 +1,215 @@
+from ins_nav.calibration import magcal, MagCalibrator
+import numpy as np
+import pytest
+
+
+def mag_data(n, seed=1, noise=0.5):
+    """Points on an ellipsoid, sphere of 45uT scaled then offset by b"""
+    rng = np.random.default_rng(seed)
+    v = rng.standard_normal((n,3))
+    v /= np.linalg.norm(v, axis=1)[:,None]
+    m = v*np.array([45,50,40.]) + np.array([10,-20,5.])
+    return m + noise*rng.standard_normal((n,3))
+
+def test_magcal():
+    A, b, expmfs = magcal(mag_data(5000, noise=0))
+    assert np.allclose(b, [10,-20,5], atol=0.5)
+    assert np.allclose(np.diag(A)*[45,50,40], expmfs, rtol=0.01)
+
+def test_streaming():
+    m = mag_data(20000)
+    cal = MagCalibrator(uT=45)
+    for chunk in np.array_split(m[:-1], 37):
+        cal.update(chunk)
+    cal.update(m[-1])   # one sample at a time works too
+
+    assert cal.n == len(m)
+    for x, y in zip(cal.solve(), magcal(m, uT=45)):
+        assert np.allclose(x, y)
+
+    cal.reset()
+    assert cal.n == 0
+
+def test_ellipsoid_fit():
+    from ins_nav import Madgwick
+    from ins_nav.calibration import ellipsoid_fit
+
+    rng = np.random.default_rng(0)
+    v = rng.standard_normal((5000,3))
+    v /= np.linalg.norm(v, axis=1)[:,None]
+    S = np.array([[1.1,0.08,-0.05],[0.08,0.9,0.03],[-0.05,0.03,1.05]])  # soft-iron
+    m = 48*v @ S.T + np.array([10,-20,5.]) + 0.3*rng.standard_normal((5000,3))
+
+    A, b, expmfs = ellipsoid_fit(m, uT=48)
+    assert np.allclose(b, [10,-20,5], atol=0.1)
+    assert np.allclose(A, A.T)
+    assert np.allclose(A @ S, np.eye(3), atol=0.01)
+    assert abs(expmfs - 48*np.linalg.det(S)**(1/3)) < 0.1
+
+    # much better than the diagonal fit
+    r = np.linalg.norm((m - b) @ A.T, axis=1)
+    A2, b2, _ = magcal(m, uT=48)
+    r2 = np.linalg.norm((m - b2) @ A2.T, axis=1)
+    assert np.std(r) < 0.4 < 2 < np.std(r2)
+
+    # drops straight into the filter
+    f = Madgwick(0.1, 0.0)
+    f.M, f.bias, _ = ellipsoid_fit(m)
+    q, _ = f.run(np.tile([0,0,1.], (10,1)), np.zeros((10,3)), m[:10], 0.01)
+    assert np.all(np.isfinite(q))
+
+    # all in a plane
+    flat = m.copy()
+    flat[:,2] = 5
+    with pytest.raises(ValueError):
+        ellipsoid_fit(flat)
+
+def tumble(N, S, b, seed=0):
+    """Slowly tumbling vehicle at 560Hz in a 48uT field"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(N)/560
+    v = np.column_stack((
+        np.cos(0.93*t)*np.cos(0.85*t),
+        np.sin(0.93*t)*np.cos(0.85*t),
+        np.sin(0.85*t)))
+    return 48*v @ S.T + b + 0.3*rng.standard_normal((N,3))
+
+def test_mag_tracker():
+    from ins_nav import Madgwick
+    from ins_nav.calibration import ellipsoid_fit
+    from ins_nav.calibration.calmag import MagTracker
+
+    S = np.array([[1.1,0.08,-0.05],[0.08,0.9,0.03],[-0.05,0.03,1.05]])
+    before = tumble(20000, S, np.array([10,-20,5.]))
+    after = tumble(40000, S, np.array([25,-10,0.]), seed=1)  # payload change
+    spikes = np.zeros(len(after), dtype=bool)
+    spikes[::997] = True
+    after[spikes] += 80
+
+    f = Madgwick(0.1, 0.0)
+    f.M, f.bias, _ = ellipsoid_fit(before, uT=48)
+    trk = f.track_mag()
+    M, bias = f.M, f.bias
+
+    f.run(np.tile([0,0,1.], (len(after),1)), np.zeros((len(after),3)), after, 1/560)
+
+    assert f.bias is bias and f.M is M  # updated in place
+    assert np.allclose(f.bias, [25,-10,0], atol=0.1)
+    assert np.allclose(f.M @ S, np.eye(3), atol=0.01)
+    assert trk.rejected >= np.count_nonzero(spikes)
+
+    r = np.linalg.norm((after[~spikes][-5000:] - f.bias) @ f.M.T, axis=1)
+    assert abs(np.mean(r) - 48) < 0.1 and np.std(r) < 0.4
+
+    # zeroed readings at power up don't start it off with a zero scale
+    t = MagTracker()
+    assert not t.update(np.zeros(3)) and t.theta is None
+    for m in after[~spikes][:2000]:
+        t.update(m)
+    assert np.all(np.isfinite(t.bias)) and np.all(np.isfinite(t.M))
+    assert t.accepted > 1900
+
+    # a single spike doesn't get used
+    assert not trk.update(f.bias + [200, 0, 0])
+    f.update(np.array([0,0,1.]), np.zeros(3), after[-1], 1/560)
+    assert np.allclose(f.bias, [25,-10,0], atol=0.1)
+
+def raw_accel(holds, seed=0):
+    """
+    Six pose recording with the sensor turned by hand between poses,
+    holds are the number of samples each pose is held, 1.02 scale error
+    and 0.01g bias
+    """
+    rng = np.random.default_rng(seed)
+    up = np.vstack((np.eye(3), -np.eye(3)))[[0,3,1,4,2,5]]  # x-up, x-down, y-up, ...
+    parts = []
+    for i, n in enumerate(holds):
+        parts.append(np.tile(up[i], (n,1)))
+        # move to the next pose, with some shaking
+        nxt = up[(i + 1) % 6]
+        t = np.linspace(0, 1, 300)[:,None]
+        v = (1 - t)*up[i] + t*nxt + 0.2*np.sin(40*t)
+        parts.append(v/np.linalg.norm(v, axis=1)[:,None])
+    g = np.vstack(parts)
+    return 1.02*g + 0.01 + 0.002*rng.standard_normal(g.shape)
+
+def test_static_segments():
+    from ins_nav.calibration import accelcal, static_segments
+    from ins_nav.calibration.calaccel import correct
+
+    holds = [3000, 9000, 2000, 5000, 4000, 7000]  # not equal length
+    a = raw_accel(holds)
+
+    segments, names = static_segments(a)
+    assert names == ["x-up", "x-down", "y-up", "y-down", "z-up", "z-down"]
+    stop = np.cumsum(np.add(holds, 300)) - 300
+    assert np.all(np.abs(segments[:,1] - stop) <= 50)
+    assert np.all(segments[:,1] - segments[:,0] >= np.array(holds) - 100)
+
+    A = accelcal(a)
+    g = correct(a[segments[0,0]:segments[0,1]], A)
+    assert np.allclose(g.mean(axis=0), [1,0,0], atol=1e-3)
+
+    # a pose that was never held
+    with pytest.raises(ValueError):
+        accelcal(a[:segments[4,0]])
+
+def test_magcal_batch():
+    from ins_nav.calibration import magcal_batch
+
+    # ragged, one board too short to solve
+    boards = [mag_data(n, seed=k) + 3*k for k, n in enumerate([5000, 3000, 4000])]
+    boards.append(mag_data(3))
+    boards.append(np.empty((0,3)))
+    A, b, expmfs, rms = magcal_batch(boards, uT=45)
+
+    for k, m in enumerate(boards[:3]):
+        for x, y in zip((A[k], b[k], expmfs[k]), magcal(m, uT=45)):
+            assert np.allclose(x, y)
+    assert np.all(rms[:3] < 5)
+    assert np.all(np.isnan(b[3]))
+    assert np.all(np.isnan(A[4])) and np.isnan(expmfs[4]) and np.isnan(rms[4])
+    assert all(np.all(np.isnan(x)) for x in magcal_batch(np.empty((2,0,3))))
+
+    # same thing as a padded array and mask
+    data = np.full((3, 5000, 3), np.nan)
+    mask = np.zeros((3, 5000), dtype=bool)
+    for k, m in enumerate(boards[:3]):
+        data[k,:len(m)] = m
+        mask[k,:len(m)] = True
+    for x, y in zip(magcal_batch(data, mask, uT=45), (A, b, expmfs, rms)):
+        assert np.allclose(x, y[:3])
+
+def test_accelcal_batch():
+    from ins_nav.calibration import accelcal, accelcal_batch
+
+    boards = [raw_accel(h, seed=k) for k, h in enumerate(
+        ([3000, 9000, 2000, 5000, 4000, 7000], [4000]*6, [2000]*6))]
+    boards.append(boards[0][:10000])  # x-up and x-down only
+
+    A, rms = accelcal_batch(boards)
+    for k, a in enumerate(boards[:3]):
+        assert np.allclose(A[k], accelcal(a))
+    assert np.all(rms[:3] < 0.01)
+    assert np.all(np.isnan(A[3])) and np.isnan(rms[3])
+
+    # six equal blocks in a given order
+    order = ["x-up", "x-down", "y-up", "y-down", "z-up", "z-down"]
+    rng = np.random.default_rng(0)
+    g = np.repeat(np.vstack((np.eye(3), -np.eye(3)))[[0,3,1,4,2,5]], 500, axis=0)
+    data = 1.02*g + 0.01 + 0.002*rng.standard_normal((2,) + g.shape)
+    A, rms = accelcal_batch(data, order)
+    for k in range(2):
+        assert np.allclose(A[k], accelcal(data[k], order))
+
+    # the same blocks with bad samples mixed in and masked out
+    bad = np.zeros((2, 4000, 3))
+    mask = np.zeros((2, 4000), dtype=bool)
+    mask[0, ::4] = mask[0, 1::4] = mask[0, 3::4] = True
+    mask[1, rng.choice(4000, 3000, replace=False)] = True
+    bad[mask] = data.reshape(-1, 3)
+    bad[~mask] = 5*rng.standard_normal((1000*2, 3))
+    A, rms = accelcal_batch(bad, order, mask)
+    for k in range(2):
+        assert np.allclose(A[k], accelcal(bad[k][mask[k]], order))
+    assert np.all(rms < 0.01)
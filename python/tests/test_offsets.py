@@ -0,0 +1,43 @@
+from ins_nav import WGS84, NavigationFrame, ECEFOffsets
+import numpy as np
+
+
+def cloud(N=10000):
+    rng = np.random.default_rng(0)
+    return np.column_stack((
+        40 + rng.normal(0, 0.03, N),
+        -90 + rng.normal(0, 0.04, N),
+        100 + rng.uniform(0, 500, N)))
+
+def test_precision():
+    wgs = WGS84()
+    llh = cloud()
+    ecef = wgs.llh2ecef(llh)
+
+    for pts in [ECEFOffsets.from_ecef(ecef), ECEFOffsets.from_llh(llh, chunk=1000)]:
+        assert pts.offsets.dtype == np.float32
+        assert pts.nbytes < 0.51*ecef.nbytes
+        assert pts.resolution < 1e-3
+        assert np.max(np.abs(pts.ecef() - ecef)) <= pts.resolution
+        assert np.max(np.abs(wgs.ecef2llh(pts)[:,2] - llh[:,2])) < 2e-3
+
+    # plain float32 is nowhere near
+    assert np.max(np.abs(ecef.astype(np.float32) - ecef)) > 0.1
+
+def test_frames():
+    wgs = WGS84()
+    frame = NavigationFrame((40, -90, 100))
+    ecef = wgs.llh2ecef(cloud())
+    pts = ECEFOffsets.from_ecef(ecef)
+
+    assert np.allclose(frame.ecef2ned(pts), frame.ecef2ned(ecef), atol=2e-3, rtol=0)
+    assert np.allclose(frame.ecef2enu(pts), frame.ecef2enu(ecef), atol=2e-3, rtol=0)
+
+    ned = frame.ecef2ned(ecef)
+    local = ECEFOffsets.from_ned(frame, ned)
+    assert np.array_equal(local.origin, frame.ecefr)
+    assert np.allclose(local.ecef(), ecef, atol=2e-3, rtol=0)
+    assert np.allclose(ECEFOffsets.from_enu(frame, frame.ned2enu(ned)).offsets, local.offsets)
+
+    assert len(pts[10:20]) == 10
+    assert np.allclose(frame.ecef2ned(pts[3])[0], frame.ecef2ned(ecef[3]), atol=2e-3)
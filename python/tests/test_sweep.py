@@ -0,0 +1,65 @@
+from ins_nav.filters.sweep import sweep, load_log
+from pathlib import Path
+import numpy as np
+import sys
+
+logfile = str(Path(__file__).parents[2] / "docs/jupyter/data-mag-2022-07-10.pkl")
+
+def static_log(N=300):
+    # level and still sensor with a gyro bias, so the truth is known
+    rng = np.random.default_rng(2)
+    return {
+        "accel": np.array([0,0,1.]) + 0.01*rng.standard_normal((N,3)),
+        "gyro": np.array([0.01,-0.02,0.]) + 0.001*rng.standard_normal((N,3)),
+        "mag": np.array([20,0,-40.]) + 0.1*rng.standard_normal((N,3)),
+        "dt": 0.01*np.ones(N),
+        "q": np.tile([1.,0,0,0], (N,1))
+    }
+
+def test_load_log():
+    log = load_log(logfile)
+    assert log["accel"].shape == (513,3)
+    assert log["mag"].shape == (513,3)
+    assert log["dt"][0] == 0
+    assert np.all(log["dt"][1:] > 0)
+
+def test_sweep():
+    grid = {"B": [0.01, 0.1, 0.5], "Z": [0.0, 0.01]}
+    logs = [static_log(), logfile]
+
+    table = sweep(logs, grid, workers=2, chunk=4)
+    assert len(table) == 12
+    assert set(table["log"]) == {0, 1}
+    assert np.all(np.isfinite(table[table["log"] == 0]["rms"]))
+    assert np.all(np.isnan(table[table["log"] == 1]["rms"]))  # no reference
+    assert np.all(table["settle"] >= 0)
+
+    serial = sweep(logs, grid, workers=0)
+    for name in ("B", "Z", "max", "settle"):
+        assert np.allclose(serial[name], table[name], equal_nan=True)
+
+    # larger beta pulls a level sensor in harder against the gyro bias
+    t = np.sort(table[(table["log"] == 0) & (table["Z"] == 0)], order="B")
+    assert t["rms"][-1] < t["rms"][0]
+
+def test_sweep_cache(monkeypatch):
+    loads = []
+    def load(src):
+        loads.append(src)
+        return load_log(src)
+    monkeypatch.setattr(sys.modules[sweep.__module__], "load_log", load)
+
+    # files are loaded once while they fit in the cache, again once evicted
+    grid = {"B": [0.01, 0.1], "Z": [0.0]}
+    sweep([logfile, logfile], grid, workers=0, chunk=1, cache=1)
+    assert loads.count(logfile) == 1
+
+    loads.clear()
+    other = Path(logfile)
+    sweep([logfile, other, logfile], grid, workers=0, chunk=1, cache=1)
+    assert loads.count(logfile) == 2 and loads.count(other) == 1
+
+    # in-memory logs are loaded up front, not per task
+    loads.clear()
+    sweep([static_log()], grid, workers=0, chunk=1)
+    assert len(loads) == 1
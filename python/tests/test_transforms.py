@@ -13,6 +13,7 @@ Can also double check with https://www.ngs.noaa.gov/NCAT/
 from ins_nav import *
 import pytest
 import numpy as np
+import tracemalloc
 
 data = [
     # ecef [m,m,m]    lat,lon,alt [deg,deg,m]
@@ -39,3 +40,216 @@ def test_ecef():
 
         # the altitude doesn't always come close ... so only look at lat, lon values
         assert np.allclose( wgs.ecef2llh(ecef)[:2], lla[:2] ), f"{wgs.ecef2llh(ecef)}, {lla}"
+
+def test_ecef_arrays():
+    wgs = WGS84()
+    ecef = np.array([e for e, _ in data], dtype=float)
+    llh = np.array([l for _, l in data], dtype=float)
+
+    assert wgs.llh2ecef(llh).shape == (len(data), 3)
+    assert np.allclose(wgs.llh2ecef(llh), ecef)
+    assert np.allclose(wgs.llh2ecef(llh[0]), ecef[0])
+    assert np.allclose(wgs.llh2ecef(llh[:,:2]), np.column_stack(wgs.llh2ecef(*llh[:,:2].T, 0)))
+
+    ans = wgs.ecef2llh(ecef)
+    assert ans.shape == (len(data), 3)
+    assert np.allclose(ans[:,:2], llh[:,:2])
+    assert np.allclose(ans, [wgs.ecef2llh(e) for e in ecef])
+
+    # round trip
+    assert np.allclose(wgs.ecef2llh(wgs.llh2ecef(llh)), llh)
+
+    # [3,N] (one coordinate per row) comes back as [3,N]
+    pts = np.vstack((ecef, ecef))  # N != 3
+    assert np.allclose(wgs.ecef2llh(pts.T), wgs.ecef2llh(pts).T)
+    assert np.allclose(wgs.llh2ecef(wgs.ecef2llh(pts.T)), pts.T)
+    assert np.allclose(wgs.llh2ecef(llh[:,:2].T), wgs.llh2ecef(llh[:,:2]).T)
+
+    # with 2 or 3 points rows win, [2,3] is two (lat, lon, H) and [3,2]
+    # is three (lat, lon)
+    assert np.allclose(wgs.llh2ecef(llh[:2]), ecef[:2])
+    assert np.allclose(wgs.llh2ecef(llh[:3,:2]), wgs.llh2ecef(np.vstack((llh[:3,:2], llh[:3,:2])))[:3])
+    assert np.allclose(wgs.ecef2llh(ecef[:3])[:,:2], llh[:3,:2])
+
+    # height defaults to 0
+    assert np.allclose(wgs.llh2ecef(*llh[0,:2]), wgs.llh2ecef(*llh[0,:2], 0))
+
+    with pytest.raises(ValueError):
+        wgs.ecef2llh(np.ones((4,5)))
+
+def test_haversine():
+    wgs = WGS84()
+    rng = np.random.default_rng(0)
+    a = np.column_stack((rng.uniform(-89, 89, 50), rng.uniform(-180, 180, 50)))
+    b = np.column_stack((rng.uniform(-89, 89, 70), rng.uniform(-180, 180, 70)))
+    ref = np.array([[wgs.haversine(x, y) for y in b] for x in a])
+
+    assert np.isclose(wgs.haversine((0,0), (0,180)), np.pi*wgs.r)
+    assert np.allclose(wgs.haversine(a[3], b), ref[3])          # one to many
+    assert np.allclose(wgs.haversine(a, b[:50]), ref.diagonal())  # element-wise
+
+    blocks = list(wgs.haversine_blocks(a, b, rows=16))
+    assert [i for i, _ in blocks] == [0, 16, 32, 48]
+    assert np.allclose(np.concatenate([d for _, d in blocks]), ref, atol=1e-5)
+
+    # rows from the memory budget, 3 [rows,N] arrays
+    blocks = list(wgs.haversine_blocks(a, b, max_bytes=24*70*10))
+    assert [i for i, _ in blocks] == [0, 10, 20, 30, 40]
+    assert np.allclose(np.concatenate([d for _, d in blocks]), ref, atol=1e-5)
+
+    b = np.tile(b, (100,1))
+    tracemalloc.start()
+    for _, d in wgs.haversine_blocks(a, b, max_bytes=1<<23):
+        del d
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 1.1*(1<<23)
+
+def test_frame_arrays():
+    f = NavigationFrame((40, -90, 100))
+    rng = np.random.default_rng(0)
+    ecef = f.ecefr + 1000*rng.standard_normal((100, 3))
+
+    for fwd, back in [("ecef2enu", "enu2ecef"), ("ecef2ned", "ned2ecef")]:
+        local = getattr(f, fwd)(ecef)
+        assert local.shape == (100, 3)
+        assert np.allclose(local[7], getattr(f, fwd)(ecef[7]))
+        assert np.allclose(getattr(f, back)(local), ecef)
+
+        out = np.empty((100, 3))
+        assert getattr(f, fwd)(ecef, out=out) is out
+        assert np.allclose(out, local)
+
+    # up is -down and the origin is at zero
+    assert np.allclose(f.ecef2enu(f.ecefr), 0)
+    assert np.allclose(f.ned2enu(f.ecef2ned(ecef)), f.ecef2enu(ecef))
+
+def test_frame_cache():
+    frames = FrameCache(maxsize=2, digits=4)
+
+    a = frames.get((40, -90))
+    assert frames.get((40.00001, -90.00002, 0.001)) is a  # rounds to the same origin
+    b = frames((41, -90, 100))
+    assert frames.info() == (1, 2, 2, 2)
+
+    frames.get((40, -90))        # a is now most recent
+    frames.get((42, -90))        # so b is dropped
+    assert len(frames) == 2
+    assert frames.get((41, -90, 100)) is not b
+    assert frames.info().misses == 4
+
+    assert np.allclose(a.ecefr, NavigationFrame((40, -90)).ecefr)
+
+@pytest.mark.parametrize("lat", [0, 45, -70, 89])
+def test_flat_earth(lat):
+    f = NavigationFrame((lat, 179.99, 100))
+    rng = np.random.default_rng(1)
+    r = f.flat_radius(0.1)
+    llh = np.column_stack((
+        lat + rng.normal(0, 2*r, 500)/111e3,
+        179.99 + rng.normal(0, 2*r, 500)/(111e3*np.cos(np.radians(lat))),
+        100 + rng.uniform(-20, 50, 500)))
+    llh[:,1] = (llh[:,1] + 180) % 360 - 180  # some go over the anti-meridian
+
+    exact = f.llh2ned(llh)
+    assert np.allclose(exact, f.ecef2ned(WGS84().llh2ecef(llh)))
+
+    for tol in [0.01, 0.1, 1.0]:
+        ned = f.llh2ned(llh, tol=tol)
+        assert np.max(np.linalg.norm(ned - exact, axis=1)) <= tol
+        enu = f.llh2enu(llh, tol=tol)
+        assert np.allclose(enu, f.ned2enu(ned))
+
+    for p in llh[:20]:
+        assert np.linalg.norm(f.llh2ned(p, tol=0.1) - f.llh2ned(p)) <= 0.1
+
+    # bigger height changes shrink the radius
+    assert 0 < f.flat_radius(0.1, 100) < r
+
+def test_gravity():
+    wgs = WGS84()
+    lat = np.array([0, 45, 90, -90])
+
+    g = wgs.normal_gravity(lat)
+    assert np.allclose(g[[0,2,3]], [wgs.ge, wgs.gp, wgs.gp])
+    assert np.allclose(g, wgs.gravity(lat), atol=1e-5)  # the old sea level model
+    assert np.allclose(wgs.gravity(lat), [wgs.gravity(x) for x in lat])
+    assert np.allclose(wgs.radius(lat), [wgs.a, wgs.radius(45), wgs.b, wgs.b])
+
+    # free air gradient is about 3.086e-6 (m/s^2)/m
+    dg = (wgs.normal_gravity(45, 1000) - wgs.normal_gravity(45, 0))/1000
+    assert abs(dg + 3.086e-6) < 1e-8
+
+    table = GravityTable(tol=1e-8)
+    assert table.error <= 1e-8
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(-90, 90, 1000)
+    h = rng.uniform(-400, 15000, 1000)
+    assert np.max(np.abs(table(lat, h) - wgs.normal_gravity(lat, h))) <= 1e-8
+    assert abs(table(45.3, 1000.0) - wgs.normal_gravity(45.3, 1000.0)) <= 1e-8
+    assert abs(table(90.0) - wgs.gp) < 1e-9
+
+    # symmetric, clipped past the poles, nan in nan out
+    assert np.allclose(table(-lat, h), table(lat, h))
+    g = table(np.array([np.nan, 95.0, -120.0, 45.0]), 100.0)
+    assert np.isnan(g[0])
+    assert np.allclose(g[1:], [table(90.0, 100.0), table(90.0, 100.0), table(45.0, 100.0)])
+    assert np.isnan(table(float("nan"))) and table(95.0) == table(90.0)
+
+    coarse = wgs.gravity_table(step=1.0)
+    assert coarse.step == 1.0 and coarse.error > table.error
+
+def test_geodesic():
+    wgs = WGS84()
+    dms = lambda d, m, s: np.sign(d)*(abs(d) + m/60 + s/3600)
+
+    # Flinders Peak to Buninyong, Vincenty (1975)
+    a = (dms(-37, 57, 3.72030), dms(144, 25, 29.52440))
+    b = (dms(-37, 39, 10.15610), dms(143, 55, 35.38390))
+    az = dms(306, 52, 5.37)
+    dist, az1, az2 = wgs.geodesic_inverse(a, b)
+    assert abs(dist - 54972.271) < 1e-3
+    assert abs(az1 % 360 - az) < 1e-5
+    assert abs(az2 % 360 - (dms(127, 10, 25.07) + 180)) < 1e-5
+
+    pt, _ = wgs.geodesic_direct(a, az, 54972.271)
+    assert np.allclose(pt, b, atol=1e-8)
+
+    rng = np.random.default_rng(0)
+    A = np.column_stack((rng.uniform(-89, 89, 1000), rng.uniform(-180, 180, 1000)))
+    B = np.column_stack((rng.uniform(-89, 89, 1000), rng.uniform(-180, 180, 1000)))
+    B[:3] = [(0, 179.8), (0, 179.5), (0, 0)]
+    A[:3] = [(0, 0), (0, 0), (0, 0)]
+    dist, az1, az2 = wgs.geodesic_inverse(A, B)
+
+    # nearly antipodal points don't converge, everything else does
+    assert np.all(np.isnan(dist[:2])) and dist[2] == 0
+    ok = ~np.isnan(dist)
+    assert np.count_nonzero(ok) > 990
+    assert np.allclose(dist[ok], wgs.haversine(A[ok], B[ok]), rtol=6e-3)
+    assert np.isclose(dist[10], wgs.geodesic_inverse(A[10], B[10])[0])
+
+    # round trip
+    pt, _ = wgs.geodesic_direct(A[ok], az1[ok], dist[ok])
+    d = pt - B[ok]
+    d[:,1] = (d[:,1] + 180) % 360 - 180
+    assert np.max(np.abs(d)) < 1e-8
+
+@pytest.mark.parametrize("method,tol", [("zhu", 1e-9), ("bowring", 1e-9), ("iterative", 1e-12)])
+def test_ecef2llh_methods(method, tol):
+    wgs = WGS84()
+    rng = np.random.default_rng(0)
+    llh = np.column_stack((rng.uniform(-89.9, 89.9, 1000), rng.uniform(-180, 180, 1000), rng.uniform(-500, 20000, 1000)))
+
+    ans = wgs.ecef2llh(wgs.llh2ecef(llh), method=method)
+    assert np.max(np.abs(ans[:,:2] - llh[:,:2])) < tol  # deg
+    assert np.max(np.abs(ans[:,2] - llh[:,2])) < 1e-6   # m
+    assert np.allclose(wgs.ecef2llh(data[2][0], method=method), wgs.ecef2llh(data[2][0]))
+
+def test_ecef2llh_poles():
+    wgs = WGS84()
+    for method in ["bowring", "iterative"]:
+        assert np.allclose(wgs.ecef2llh((0, 0, -wgs.b - 100), method=method), (-90, 0, 100))
+
+    with pytest.raises(ValueError):
+        wgs.ecef2llh(data[0][0], method="nope")
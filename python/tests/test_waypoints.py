@@ -0,0 +1,81 @@
+from ins_nav import WGS84, WaypointIndex
+import numpy as np
+import pytest
+
+
+def test_queries():
+    wgs = WGS84()
+    rng = np.random.default_rng(1)
+    wp = np.column_stack((rng.uniform(39, 41, 2000), rng.uniform(-91, -89, 2000)))
+    fixes = np.column_stack((rng.uniform(39, 41, 50), rng.uniform(-91, -89, 50)))
+    idx = WaypointIndex(wp, leaf=16)
+
+    for f in fixes:
+        d = wgs.haversine(f, wp)
+
+        ids, dist = idx.nearest(f, 5)
+        assert np.array_equal(ids, np.argsort(d)[:5])
+        assert np.allclose(dist, np.sort(d)[:5])
+
+        ids, dist = idx.within(f, 5000)
+        assert np.array_equal(np.sort(ids), np.nonzero(d <= 5000)[0])
+        assert np.all(np.diff(dist) >= 0)
+
+def test_insert_remove():
+    idx = WaypointIndex()
+    assert len(idx.nearest((40,-90))[0]) == 0
+
+    a = idx.insert((40, -90))
+    b = idx.insert((40.01, -90))
+    far = idx.insert((-40, 90))  # other side of the world
+    assert len(idx) == 3
+    assert idx[b] == (40.01, -90)
+
+    assert idx.nearest((40.001, -90))[0][0] == a
+    idx.remove(a)
+    assert a not in idx
+    assert idx.nearest((40.001, -90))[0][0] == b
+    assert list(idx.nearest((40, -90), k=5)[0]) == [b, far]
+    assert len(idx.within((40, -90), 100)[0]) == 0
+
+    with pytest.raises(KeyError):
+        idx.remove(a)
+
+def test_query_cost():
+    # only the leaves near the query are checked, not every waypoint
+    rng = np.random.default_rng(2)
+    v = rng.standard_normal((20000,3))
+    v /= np.linalg.norm(v, axis=1)[:,None]
+    wp = np.degrees(np.column_stack((np.arcsin(v[:,2]), np.arctan2(v[:,1], v[:,0]))))
+    idx = WaypointIndex(wp)
+
+    leaves = []
+    for f in wp[:100] + 0.01:
+        idx.nearest(f, 5)
+        leaves.append(idx.visited)
+    assert np.mean(leaves) < 4 and max(leaves) < 16  # of 20000/32 = 625
+
+    idx.within(wp[0], 10000)
+    assert idx.visited < 8
+    assert len(idx.within(wp[0], 1e8)[0]) == len(wp)
+    assert idx.visited == 0
+
+def test_changes_match_brute_force():
+    wgs = WGS84()
+    rng = np.random.default_rng(3)
+    idx = WaypointIndex(leaf=8)
+    live = {}
+    for step in range(30):
+        # enough changes to rebuild the tree a few times
+        for p in np.column_stack((rng.uniform(-60, 60, 40), rng.uniform(-180, 180, 40))):
+            live[idx.insert(p)] = p
+        for i in rng.choice(list(live), 15, replace=False).tolist():
+            idx.remove(i)
+            del live[i]
+
+        ids = np.array(list(live))
+        f = (rng.uniform(-60, 60), rng.uniform(-180, 180))
+        d = wgs.haversine(f, np.array([live[i] for i in ids.tolist()]))
+        assert np.array_equal(idx.nearest(f, 3)[0], ids[np.argsort(d)[:3]])
+        got, _ = idx.within(f, 2e6)
+        assert np.array_equal(np.sort(got), np.sort(ids[d <= 2e6]))